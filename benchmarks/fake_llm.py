@@ -0,0 +1,66 @@
+# A local stand-in for an LLM api handler, with configurable latency and failures.
+import asyncio
+import random
+from typing import Callable
+
+from llmtaskgraph.instrumentation import record_api_call, record_retry
+from llmtaskgraph.types import JSON, Prompt
+
+
+def constant_latency(seconds: float) -> Callable[[random.Random], float]:
+    return lambda _: seconds
+
+
+def uniform_latency(low: float, high: float) -> Callable[[random.Random], float]:
+    return lambda rng: rng.uniform(low, high)
+
+
+def lognormal_latency(
+    median: float, sigma: float = 0.5
+) -> Callable[[random.Random], float]:
+    # Long-tailed, like real LLM APIs.
+    return lambda rng: median * rng.lognormvariate(0, sigma)
+
+
+class FakeApiError(Exception):
+    pass
+
+
+class FakeLlmApiHandler:
+    def __init__(
+        self,
+        latency: Callable[[random.Random], float] = constant_latency(0),
+        failure_rate: float = 0.0,
+        retries: int = 5,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.retries = retries
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.failures = 0
+
+    async def api_call(self, prompt: Prompt, params: JSON) -> str:
+        return (await self.api_call_choices(prompt, params))[0]
+
+    async def api_call_choices(self, prompt: Prompt, params: JSON) -> list[str]:
+        # Failed attempts are retried immediately, like a handler with retry logic would.
+        for attempt in range(self.retries + 1):
+            self.requests += 1
+            latency = self.latency(self.rng)
+            if latency > 0:
+                await asyncio.sleep(latency)
+            else:
+                await asyncio.sleep(0)
+            if self.rng.random() >= self.failure_rate:
+                record_api_call(latency)
+                break
+            self.failures += 1
+            if attempt == self.retries:
+                raise FakeApiError("Simulated API failure")
+            record_retry()
+
+        n = params.get("n", 1)
+        assert isinstance(n, int)
+        return [f"1. response to {prompt}" for _ in range(n)]
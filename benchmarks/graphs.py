@@ -0,0 +1,167 @@
+# Synthetic graph shapes for benchmarks. Every builder takes a size and returns a graph
+# of LLMTasks calling the `fake_llm` api handler registered in the given registry.
+from typing import Callable
+
+from llmtaskgraph.function_registry import FunctionId, FunctionRegistry
+from llmtaskgraph.task import LLMTask, MapTask, PythonTask, Task, TaskGraphTask
+from llmtaskgraph.task_graph import GraphContext, TaskGraph
+from llmtaskgraph.types import JSON, JSONValue, Prompt
+
+from .fake_llm import FakeLlmApiHandler
+
+
+class GraphFunctions:
+    def __init__(self, api_handler: FakeLlmApiHandler):
+        self.llm_task_count = 0
+        self.registry = FunctionRegistry()
+        self.fake_llm: FunctionId[[Prompt, JSON], str] = (
+            self.registry.register_api_handler(
+                api_handler.api_call, sample_many=api_handler.api_call_choices
+            )
+        )
+        self.format_prompt = self.registry.register(_format_prompt)
+        self.format_item_prompt = self.registry.register(_format_item_prompt)
+        self.list_items = self.registry.register(_list_items)
+        self.parse = self.registry.register_no_context(_parse)
+        self.join = self.registry.register_no_context(_join)
+        self.grow = self.registry.register(self._grow)
+
+    def llm_task(self, *deps: Task) -> LLMTask:
+        # Unique params keep identical tasks from being coalesced into one request.
+        self.llm_task_count += 1
+        return LLMTask(
+            self.format_prompt,
+            self.fake_llm,
+            {"model": "fake", "seed": self.llm_task_count},
+            self.parse,
+            *deps,
+        )
+
+    def _grow(self, context: GraphContext, *_: JSONValue) -> JSONValue:
+        # Adds one LLMTask and one more growing task, up to graph_input tasks.
+        num_tasks = len(context.list_tasks())
+        graph_input = context.graph_input()
+        assert isinstance(graph_input, int)
+        if num_tasks < graph_input:
+            llm_task = self.llm_task()
+            context.add_task(llm_task)
+            context.add_task(PythonTask(self.grow, llm_task))
+        return num_tasks
+
+
+def _format_prompt(context: GraphContext, *dep_results: JSONValue) -> str:
+    return f"{context.graph_input()} {len(dep_results)}"
+
+
+def _format_item_prompt(context: GraphContext, item: JSONValue) -> str:
+    # Distinct prompts keep elements from being coalesced into one request.
+    return f"item {item}"
+
+
+def _list_items(context: GraphContext) -> JSONValue:
+    graph_input = context.graph_input()
+    assert isinstance(graph_input, int)
+    return list(range(graph_input))
+
+
+def _parse(response: str) -> str:
+    return response[3:]
+
+
+def _join(*results: JSONValue) -> JSONValue:
+    return list(results)
+
+
+def wide(functions: GraphFunctions, num_tasks: int) -> TaskGraph:
+    graph = TaskGraph()
+    root = functions.llm_task()
+    graph.add_task(root)
+    leaves = [functions.llm_task(root) for _ in range(num_tasks - 2)]
+    for leaf in leaves:
+        graph.add_task(leaf)
+    graph.add_output_task(PythonTask(functions.join, *leaves))
+    return graph
+
+
+def chain(functions: GraphFunctions, num_tasks: int) -> TaskGraph:
+    graph = TaskGraph()
+    previous = functions.llm_task()
+    graph.add_task(previous)
+    for _ in range(num_tasks - 1):
+        previous = functions.llm_task(previous)
+        graph.add_task(previous)
+    graph.output_task = previous
+    return graph
+
+
+def diamonds(functions: GraphFunctions, num_tasks: int) -> TaskGraph:
+    # A chain of diamonds, each fanning out to 4 tasks and back in.
+    graph = TaskGraph()
+    top = functions.llm_task()
+    graph.add_task(top)
+    for _ in range(max(1, (num_tasks - 1) // 5)):
+        middle = [functions.llm_task(top) for _ in range(4)]
+        for task in middle:
+            graph.add_task(task)
+        top = functions.llm_task(*middle)
+        graph.add_task(top)
+    graph.output_task = top
+    return graph
+
+
+def nested(functions: GraphFunctions, num_tasks: int) -> TaskGraph:
+    # Wide graphs of 10 tasks, each wrapped in a TaskGraphTask.
+    graph = TaskGraph()
+    subgraph_tasks = [
+        TaskGraphTask(wide(functions, 10), functions.join)
+        for _ in range(max(1, num_tasks // 11))
+    ]
+    for task in subgraph_tasks:
+        graph.add_task(task)
+    graph.add_output_task(PythonTask(functions.join, *subgraph_tasks))
+    return graph
+
+
+def dynamic(functions: GraphFunctions, num_tasks: int) -> TaskGraph:
+    # Grows by GraphContext.add_task while running.
+    graph = TaskGraph()
+    graph.add_task(PythonTask(functions.grow))
+    graph.graph_input = num_tasks
+    return graph
+
+
+def mapped(functions: GraphFunctions, num_tasks: int) -> TaskGraph:
+    # A MapTask fanning out over a list of num_tasks - 1 elements.
+    graph = TaskGraph()
+    items = PythonTask(functions.list_items)
+    graph.add_task(items)
+    template = LLMTask(
+        functions.format_item_prompt,
+        functions.fake_llm,
+        {"model": "fake"},
+        functions.parse,
+    )
+    graph.add_output_task(MapTask(template, items))
+    graph.graph_input = num_tasks - 1
+    return graph
+
+
+SHAPES: dict[str, Callable[[GraphFunctions, int], TaskGraph]] = {
+    "wide": wide,
+    "chain": chain,
+    "diamonds": diamonds,
+    "nested": nested,
+    "dynamic": dynamic,
+    "mapped": mapped,
+}
+
+
+def count_tasks(graph: TaskGraph) -> int:
+    count = 0
+    for task in graph.tasks:
+        count += 1
+        if isinstance(task, TaskGraphTask):
+            count += count_tasks(task.subgraph)
+        elif isinstance(task, MapTask):
+            count += len(task.children)
+    return count
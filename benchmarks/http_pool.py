@@ -0,0 +1,142 @@
+# Runs many concurrent LLMTasks through OpenAiChatApiHandler against a local mock of the
+# chat completions endpoint, and counts the connections it accepts, with and without a
+# pooled HttpClient. Run with `python -m benchmarks.http_pool`; the pooled runs should
+# open at most max_connections connections, however many tasks there are.
+import asyncio
+import time
+from typing import Optional
+
+import openai
+from aiohttp import web
+
+from llmtaskgraph.api_handler import OpenAiChatApiHandler
+from llmtaskgraph.function_registry import FunctionRegistry, dont_parse
+from llmtaskgraph.http_client import HttpClient
+from llmtaskgraph.task import LLMTask
+from llmtaskgraph.task_graph import GraphContext, TaskGraph
+
+
+class MockServer:
+    # Answers every chat completion request after `latency` seconds, and records the
+    # client address of each connection. Answers with an error instead if `status` is
+    # set to one, or with a 429 beyond max_in_flight concurrent requests.
+    def __init__(self, latency: float = 0.05, max_in_flight: Optional[int] = None):
+        self.latency = latency
+        self.max_in_flight = max_in_flight
+        self.status = 200
+        self.connections: set[object] = set()
+        self.requests = 0
+        self.in_flight = 0
+        self.runner: Optional[web.AppRunner] = None
+        self.url = ""
+
+    async def handle(self, request: web.Request) -> web.Response:
+        assert request.transport is not None
+        self.connections.add(request.transport.get_extra_info("peername"))
+        self.requests += 1
+        body = await request.json()
+        if self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+            return web.json_response(
+                {"error": {"message": "Rate limit reached"}},
+                status=429,
+                headers={"Retry-After": "1"},
+            )
+        if self.status != 200:
+            return web.json_response(
+                {"error": {"message": "Mock server error"}}, status=self.status
+            )
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        content = body["messages"][-1]["content"].upper()
+        return web.json_response(
+            {
+                "object": "chat.completion",
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 1,
+                    "completion_tokens": 1,
+                    "total_tokens": 2,
+                },
+            }
+        )
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0, backlog=1024)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}/v1"
+
+    async def stop(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+
+def _format_prompt(context: GraphContext) -> str:
+    return f"request {context.task.task_id}"
+
+
+async def run(
+    server: MockServer, num_tasks: int, http_client: Optional[HttpClient]
+) -> tuple[float, int]:
+    # Returns the time taken and the number of connections opened.
+    handler = OpenAiChatApiHandler()
+    handler.http_client = http_client
+    function_registry = FunctionRegistry()
+    format_prompt = function_registry.register(_format_prompt)
+    chat = function_registry.register_api_handler(
+        handler.api_call,
+        sample_many=handler.api_call_choices,
+        session=handler.open_session,
+    )
+    graph = TaskGraph()
+    for _ in range(num_tasks):
+        graph.add_task(LLMTask(format_prompt, chat, {"model": "mock"}, dont_parse))
+    server.connections.clear()
+    start = time.perf_counter()
+    await graph.run(function_registry)
+    elapsed = time.perf_counter() - start
+    assert all(task.output_data for task in graph.tasks)
+    return elapsed, len(server.connections)
+
+
+async def main() -> None:
+    server = MockServer()
+    await server.start()
+    openai.api_base = server.url
+    openai.api_key = "mock"
+    try:
+        for num_tasks in [100, 500]:
+            for name, http_client in [
+                ("per-request", None),
+                ("pooled 100", HttpClient(max_connections=100)),
+                ("pooled 500", HttpClient(max_connections=500)),
+            ]:
+                elapsed, connections = await run(server, num_tasks, http_client)
+                print(
+                    f"{num_tasks:>4} tasks, {name:>11}: {elapsed:6.3f}s,"
+                    f" {connections:>4} connections"
+                )
+                if http_client is not None:
+                    assert connections <= http_client.max_connections, (
+                        f"pooled run opened {connections} connections, more than"
+                        f" max_connections={http_client.max_connections}"
+                    )
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,52 @@
+# Measures the memory used per task by large graphs, built in code and loaded from JSON,
+# and the time to load them. Run with `python -m benchmarks.memory`.
+import gc
+import json
+import time
+import tracemalloc
+from typing import Callable
+
+from llmtaskgraph.task_graph import TaskGraph
+
+from .scheduler import chain_graph, wide_graph
+from .serialization import llm_trace
+
+
+def measure(build: Callable[[], TaskGraph]) -> tuple[TaskGraph, float, int]:
+    # Returns the graph, the time to build it and the memory it holds.
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    graph = build()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return graph, elapsed, memory
+
+
+def main() -> None:
+    for name, make_graph in [
+        ("wide", wide_graph),
+        ("chain", chain_graph),
+        ("llm", llm_trace),
+    ]:
+        for num_tasks in [10_000, 100_000]:
+            graph, _, built_memory = measure(lambda: make_graph(num_tasks))
+            serialized = json.loads(json.dumps(graph.to_json()))
+            del graph
+            # Time is measured again without tracing allocations, which slows it down.
+            start = time.perf_counter()
+            TaskGraph.from_json(json.loads(json.dumps(serialized)))
+            load_time = time.perf_counter() - start
+            _, _, loaded_memory = measure(lambda: TaskGraph.from_json(serialized))
+            print(
+                f"{name:>5} {num_tasks:>6} tasks:"
+                f" built {built_memory / num_tasks:6.0f}B/task,"
+                f" loaded {loaded_memory / num_tasks:6.0f}B/task,"
+                f" from_json {load_time / num_tasks * 1e6:5.1f}us/task"
+            )
+
+
+if __name__ == "__main__":
+    main()
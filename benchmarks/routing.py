@@ -0,0 +1,125 @@
+# Runs LLMTasks through a RoutingApiHandler over several local mock servers, to check
+# that it spreads load, fails over and ejects unhealthy backends. Run with
+# `python -m benchmarks.routing`.
+import asyncio
+import time
+
+from llmtaskgraph.api_handler import OpenAiChatApiHandler
+from llmtaskgraph.function_registry import FunctionRegistry, dont_parse
+from llmtaskgraph.rate_limiter import RateLimiter
+from llmtaskgraph.routing import Backend, RoutingApiHandler
+from llmtaskgraph.task import LLMTask
+from llmtaskgraph.task_graph import GraphContext, TaskGraph
+
+from .http_pool import MockServer
+
+# Each mock server, like an api key, accepts this many concurrent requests.
+MAX_IN_FLIGHT = 20
+
+
+def _format_prompt(context: GraphContext) -> str:
+    return f"request {context.task.task_id}"
+
+
+def backend(server: MockServer, index: int) -> OpenAiChatApiHandler:
+    return OpenAiChatApiHandler(
+        limiter=RateLimiter(max_concurrent=MAX_IN_FLIGHT),
+        api_key=f"key-{index}",
+        api_base=server.url,
+    )
+
+
+async def run(handler: OpenAiChatApiHandler | RoutingApiHandler, num_tasks: int) -> str:
+    function_registry = FunctionRegistry()
+    format_prompt = function_registry.register(_format_prompt)
+    chat = function_registry.register_api_handler(
+        handler.api_call,
+        sample_many=handler.api_call_choices,
+        session=handler.open_session,
+    )
+    graph = TaskGraph()
+    for _ in range(num_tasks):
+        graph.add_task(LLMTask(format_prompt, chat, {"model": "mock"}, dont_parse))
+    start = time.perf_counter()
+    await graph.run(function_registry)
+    elapsed = time.perf_counter() - start
+    assert all(task.output_data for task in graph.tasks)
+    retries = sum(task.stats.retries for task in graph.tasks)
+    return f"{num_tasks} tasks in {elapsed:6.3f}s, {retries} retries"
+
+
+def describe(router: RoutingApiHandler) -> str:
+    now = time.monotonic()
+    return ", ".join(
+        f"{backend.name.rsplit(':', 1)[-1]}: {backend.requests} requests"
+        f" ({backend.failures} failed{', ejected' if backend.ejected_until > now else ''})"
+        for backend in router.backends
+    )
+
+
+def requests(router: RoutingApiHandler) -> list[int]:
+    return [backend.requests for backend in router.backends]
+
+
+async def main() -> None:
+    servers = [MockServer(max_in_flight=MAX_IN_FLIGHT) for _ in range(3)]
+    for server in servers:
+        await server.start()
+    try:
+        # One key's rate limit caps throughput; three keys triple it.
+        print(f"single backend: {await run(backend(servers[0], 0), 600)}")
+        router = RoutingApiHandler(
+            [backend(server, i) for i, server in enumerate(servers)]
+        )
+        print(f"least outstanding: {await run(router, 600)}\n  {describe(router)}")
+        # Equal backends get equal shares.
+        assert max(requests(router)) - min(requests(router)) <= 30, describe(router)
+
+        router = RoutingApiHandler(
+            [
+                Backend(backend(server, i), weight)
+                for i, (server, weight) in enumerate(zip(servers, [3, 1, 1]))
+            ],
+            policy="weighted",
+            seed=0,
+        )
+        print(f"weighted 3:1:1: {await run(router, 600)}\n  {describe(router)}")
+        # Around 360:120:120, give or take the randomness.
+        assert 300 <= requests(router)[0] <= 420, describe(router)
+
+        # A failing backend is ejected after a few failures, and its requests are
+        # sent to the others.
+        servers[0].status = 500
+        router = RoutingApiHandler(
+            [backend(server, i) for i, server in enumerate(servers)], cooldown=0.5
+        )
+        print(f"one failing: {await run(router, 600)}\n  {describe(router)}")
+        failing, *healthy = router.backends
+        assert failing.ejections == 1, describe(router)
+        # It is only sent the requests that were let through before it was ejected, at
+        # most as many as it accepts at once...
+        assert failing.requests == failing.failures <= MAX_IN_FLIGHT, describe(router)
+        # ...and the healthy backends serve every task, in even shares.
+        assert sum(backend.requests for backend in healthy) == 600, describe(router)
+        assert all(backend.failures == 0 for backend in healthy), describe(router)
+        assert abs(healthy[0].requests - healthy[1].requests) <= 30, describe(router)
+        # Once healthy again, it is sent one probe request after its cooldown, and
+        # then its share of requests.
+        servers[0].status = 200
+        await asyncio.sleep(0.5)
+        before = requests(router)
+        print(f"recovered: {await run(router, 600)}\n  {describe(router)}")
+        # While its probe is outstanding, every other request goes elsewhere.
+        assert failing.requests == before[0] + 1, describe(router)
+        assert failing.consecutive_failures == 0, describe(router)
+        before = requests(router)
+        print(f"after probe: {await run(router, 600)}\n  {describe(router)}")
+        assert failing.requests - before[0] >= 150, describe(router)
+        assert failing.failures <= MAX_IN_FLIGHT, describe(router)
+    finally:
+        for server in servers:
+            await server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+# Measures TaskGraph.run scheduling overhead on graphs of trivial PythonTasks.
+# Run with `python -m benchmarks.scheduler`; time per task should stay flat as graphs grow.
+import asyncio
+import time
+from typing import Callable
+
+from llmtaskgraph.function_registry import FunctionRegistry
+from llmtaskgraph.task import PythonTask, Task
+from llmtaskgraph.task_graph import GraphContext, TaskGraph
+
+
+function_registry = FunctionRegistry()
+
+
+def _identity(*args: object) -> int:
+    return len(args)
+
+
+identity = function_registry.register_no_context(_identity)
+
+
+def _grow(context: GraphContext) -> int:
+    # Each task adds the next one while the graph is running, up to graph_input tasks.
+    num_tasks = len(context.list_tasks())
+    if num_tasks < context.graph_input():
+        context.add_task(PythonTask(grow))
+    return num_tasks
+
+
+grow = function_registry.register(_grow)
+
+
+def wide_graph(num_tasks: int) -> TaskGraph:
+    graph = TaskGraph()
+    root = PythonTask(identity)
+    graph.add_task(root)
+    leaves = [PythonTask(identity, root) for _ in range(num_tasks - 2)]
+    for leaf in leaves:
+        graph.add_task(leaf)
+    graph.add_output_task(PythonTask(identity, *leaves))
+    return graph
+
+
+def chain_graph(num_tasks: int) -> TaskGraph:
+    graph = TaskGraph()
+    previous: Task = PythonTask(identity)
+    graph.add_task(previous)
+    for _ in range(num_tasks - 1):
+        previous = PythonTask(identity, previous)
+        graph.add_task(previous)
+    graph.output_task = previous
+    return graph
+
+
+def growing_graph(num_tasks: int) -> TaskGraph:
+    graph = TaskGraph()
+    graph.add_task(PythonTask(grow))
+    graph.graph_input = num_tasks
+    return graph
+
+
+def time_run(make_graph: Callable[[int], TaskGraph], num_tasks: int) -> float:
+    graph = make_graph(num_tasks)
+    start = time.perf_counter()
+    asyncio.run(graph.run(function_registry))
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    for name, make_graph in [
+        ("wide", wide_graph),
+        ("chain", chain_graph),
+        ("grow", growing_graph),
+    ]:
+        for num_tasks in [1_000, 2_500, 5_000, 10_000]:
+            elapsed = time_run(make_graph, num_tasks)
+            print(
+                f"{name:>5} {num_tasks:>6} tasks: {elapsed:7.3f}s"
+                f" ({elapsed / num_tasks * 1e6:6.1f}us/task)"
+            )
+
+
+if __name__ == "__main__":
+    main()
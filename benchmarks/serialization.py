@@ -0,0 +1,121 @@
+# Measures building, saving and loading large execution traces, as JSON and with the
+# binary trace format, and opening binary traces lazily. Run with
+# `python -m benchmarks.serialization`; all columns should scale linearly.
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Callable
+
+from llmtaskgraph import binary_trace
+from llmtaskgraph.task import LLMTask, Task
+from llmtaskgraph.task_graph import GraphContext, TaskGraph
+from llmtaskgraph.types import JSON, JSONValue, Prompt
+
+from .scheduler import chain_graph, function_registry, wide_graph
+
+
+# Never called: llm_trace builds traces that have already run.
+def _format_prompt(context: GraphContext, *dep_results: JSONValue) -> str:
+    return ""
+
+
+def _parse(response: str) -> str:
+    return response
+
+
+async def _fake_llm(prompt: Prompt, params: JSON) -> str:
+    return ""
+
+
+format_prompt = function_registry.register(_format_prompt)
+parse = function_registry.register_no_context(_parse)
+fake_llm = function_registry.register_api_handler(_fake_llm)
+
+
+def llm_trace(num_tasks: int) -> TaskGraph:
+    # A finished chain of LLMTasks with long prompts and responses, like a real trace.
+    graph = TaskGraph()
+    previous: list[Task] = []
+    for index in range(num_tasks):
+        task = LLMTask(format_prompt, fake_llm, {"model": "fake"}, parse, *previous)
+        task.formatted_prompt = f"Prompt {index}: " + "Lorem ipsum dolor sit. " * 40
+        task.response = f"Response {index}:\n" + "1. Consectetur adipiscing.\n" * 40
+        task.output_data = task.response
+        graph.add_task(task)
+        previous = [task]
+    graph.output_task = previous[0]
+    return graph
+
+
+def measure(
+    save: Callable[[TaskGraph], bytes],
+    load: Callable[[bytes], TaskGraph],
+    graph: TaskGraph,
+) -> str:
+    start = time.perf_counter()
+    saved = save(graph)
+    end_save = time.perf_counter()
+    load(saved)
+    end_load = time.perf_counter()
+    return (
+        f"save {end_save - start:6.3f}s, load {end_load - end_save:6.3f}s,"
+        f" {len(saved) / 1024 / 1024:7.2f}MB"
+    )
+
+
+def measure_lazy(graph: TaskGraph) -> str:
+    # Opens a saved trace and reads one task's output, compared with loading it all.
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "trace.ltg")
+        binary_trace.save(graph, path)
+        results = []
+        for lazy in [False, True]:
+            start = time.perf_counter()
+            binary_trace.load(path, lazy=lazy).tasks[-1].output_data
+            end = time.perf_counter()
+            # Measured separately, since tracing allocations slows loading down.
+            tracemalloc.start()
+            loaded = binary_trace.load(path, lazy=lazy)
+            loaded.tasks[-1].output_data
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del loaded
+            results.append(f"{end - start:6.3f}s, {memory / 1024 / 1024:7.2f}MB")
+    return f"eager {results[0]}; lazy {results[1]}"
+
+
+def main() -> None:
+    formats: list[
+        tuple[str, Callable[[TaskGraph], bytes], Callable[[bytes], TaskGraph]]
+    ] = [
+        (
+            "json",
+            lambda graph: json.dumps(graph.to_json()).encode(),
+            lambda data: TaskGraph.from_json(json.loads(data)),
+        ),
+        ("binary", binary_trace.dumps, binary_trace.loads),
+        (
+            "binary+zlib",
+            lambda graph: binary_trace.dumps(graph, compress=True),
+            binary_trace.loads,
+        ),
+    ]
+    for name, make_graph in [
+        ("wide", wide_graph),
+        ("chain", chain_graph),
+        ("llm", llm_trace),
+    ]:
+        for num_tasks in [10_000, 25_000, 50_000]:
+            start = time.perf_counter()
+            graph = make_graph(num_tasks)
+            built = time.perf_counter()
+            print(f"{name:>5} {num_tasks:>6} tasks: build {built - start:6.3f}s")
+            for format_name, save, load in formats:
+                print(f"  {format_name:>11}: {measure(save, load, graph)}")
+            print(f"  {'open':>11}: {measure_lazy(graph)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# Runs synthetic graphs against a simulated LLM backend and reports machine-readable
+# results. Run with `python -m benchmarks --output results.json`.
+import argparse
+import asyncio
+import json
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Optional
+
+from llmtaskgraph.blob_store import BlobStore, ReleasePolicy
+from llmtaskgraph.task_graph import TaskGraph
+
+from .fake_llm import (
+    FakeLlmApiHandler,
+    constant_latency,
+    lognormal_latency,
+    uniform_latency,
+)
+from .graphs import SHAPES, GraphFunctions, count_tasks
+
+
+def make_latency(args: argparse.Namespace) -> Callable[[Any], float]:
+    if args.latency == "constant":
+        return constant_latency(args.latency_median)
+    if args.latency == "uniform":
+        return uniform_latency(0, 2 * args.latency_median)
+    return lognormal_latency(args.latency_median, args.latency_sigma)
+
+
+def run_graph(
+    shape: str,
+    num_tasks: int,
+    api_handler: FakeLlmApiHandler,
+    release_outputs: Optional[ReleasePolicy] = None,
+) -> tuple[TaskGraph, float]:
+    functions = GraphFunctions(api_handler)
+    graph = SHAPES[shape](functions, num_tasks)
+    if graph.graph_input is None:
+        graph.graph_input = "benchmark"
+    start = time.perf_counter()
+    asyncio.run(graph.run(functions.registry, release_outputs=release_outputs))
+    return graph, time.perf_counter() - start
+
+
+def benchmark(shape: str, num_tasks: int, args: argparse.Namespace) -> dict[str, Any]:
+    # Wall time against the configured latency and failure rate.
+    api_handler = FakeLlmApiHandler(
+        make_latency(args), args.failure_rate, seed=args.seed
+    )
+    graph, wall_time = run_graph(shape, num_tasks, api_handler)
+    total_tasks = count_tasks(graph)
+
+    # Scheduler overhead: the same graph with an instantaneous, reliable backend.
+    _, overhead_time = run_graph(shape, num_tasks, FakeLlmApiHandler())
+
+    tracemalloc.start()
+    run_graph(shape, num_tasks, FakeLlmApiHandler())
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # The same, spilling outputs once they have been read.
+    blob_store = BlobStore()
+    tracemalloc.start()
+    run_graph(shape, num_tasks, FakeLlmApiHandler(), release_outputs=blob_store)
+    _, peak_memory_released = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blob_store.close()
+
+    start = time.perf_counter()
+    serialized = json.dumps(graph.to_json())
+    to_json_time = time.perf_counter() - start
+    start = time.perf_counter()
+    TaskGraph.from_json(json.loads(serialized))
+    from_json_time = time.perf_counter() - start
+
+    return {
+        "shape": shape,
+        "num_tasks": total_tasks,
+        "wall_time_s": wall_time,
+        "api_requests": api_handler.requests,
+        "api_failures": api_handler.failures,
+        "scheduler_overhead_us_per_task": overhead_time / total_tasks * 1e6,
+        "peak_memory_bytes": peak_memory,
+        "peak_memory_released_bytes": peak_memory_released,
+        "trace_bytes": len(serialized),
+        "to_json_tasks_per_s": total_tasks / to_json_time,
+        "from_json_tasks_per_s": total_tasks / from_json_time,
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark TaskGraph against a simulated LLM backend."
+    )
+    parser.add_argument(
+        "--shapes", nargs="+", choices=list(SHAPES), default=list(SHAPES)
+    )
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 1000])
+    parser.add_argument(
+        "--latency", choices=["constant", "uniform", "lognormal"], default="lognormal"
+    )
+    parser.add_argument("--latency-median", type=float, default=0.01)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = []
+    for shape in args.shapes:
+        for num_tasks in args.sizes:
+            result = benchmark(shape, num_tasks, args)
+            print(
+                f"{shape:>8} {result['num_tasks']:>6} tasks:"
+                f" {result['wall_time_s']:7.3f}s wall,"
+                f" {result['scheduler_overhead_us_per_task']:6.1f}us/task overhead",
+                file=sys.stderr,
+            )
+            results.append(result)
+
+    report = json.dumps({"config": vars(args), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
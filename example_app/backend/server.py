@@ -3,9 +3,10 @@ import asyncio
 from typing import NoReturn
 from websockets.server import serve, WebSocketServerProtocol
 import json
+from llmtaskgraph.events import TaskEvent
 from llmtaskgraph.function_registry import FunctionRegistry
-
 from llmtaskgraph.task_graph import TaskGraph
+from llmtaskgraph.types import JSON
 
 
 class WebSocketServer:
@@ -20,6 +21,9 @@ class WebSocketServer:
         self.function_registry = function_registry
         self.graph_exec = None
         self.recv: asyncio.Future[str] | None = None
+        # How much of each streaming task's partial response the client has, by the
+        # task's path and id, so that progress events only send the rest.
+        self.sent_partial_responses: dict[tuple[str, ...], int] = {}
 
     async def server(self, websocket: WebSocketServerProtocol) -> NoReturn:
         print("Client connected.")
@@ -50,6 +54,12 @@ class WebSocketServer:
                 await self.send_graph(websocket, self.state, self.task_graph)
 
     async def execute_current_graph(self, websocket: WebSocketServerProtocol) -> None:
+        # Collect task events as they happen, to be sent to the client as deltas
+        events: asyncio.Queue[TaskEvent] = asyncio.Queue()
+        task_graph = self.task_graph
+        task_graph.add_listener(events.put_nowait)
+        self.sent_partial_responses = {}
+
         # Start the current task graph, if it isn't already running
         if not self.graph_exec:
             self.graph_exec = asyncio.create_task(
@@ -57,12 +67,13 @@ class WebSocketServer:
             )
         # Also listen for a stop message
         self.recv = asyncio.create_task(websocket.recv())  # type: ignore
+        await self.send_events(websocket, [])
 
+        next_event = asyncio.create_task(events.get())
         while not self.graph_exec.done() and not self.recv.done():
-            # Wait one second or until something happens
+            # Wait until something happens
             await asyncio.wait(
-                [self.recv, self.graph_exec],
-                timeout=1,
+                [self.recv, self.graph_exec, next_event],
                 return_when=asyncio.FIRST_COMPLETED,
             )
 
@@ -80,9 +91,16 @@ class WebSocketServer:
                 print("Task graph stopped by frontend.")
                 break
 
-            # Send an updated graph to the client
-            await self.send_graph(websocket, self.state, self.task_graph)
-            print("Task graph update sent.")
+            # Send every event that has happened so far to the client
+            if next_event.done():
+                pending = [next_event.result()]
+                while not events.empty():
+                    pending.append(events.get_nowait())
+                await self.send_events(websocket, pending)
+                next_event = asyncio.create_task(events.get())
+
+        next_event.cancel()
+        task_graph.remove_listener(events.put_nowait)
 
         if self.graph_exec.done() and self.graph_exec.exception() is not None:
             print("Task graph failed.")
@@ -97,6 +115,36 @@ class WebSocketServer:
         self.graph_exec = None
         self.recv = None
 
+    async def send_events(
+        self, websocket: WebSocketServerProtocol, events: list[TaskEvent]
+    ) -> None:
+        await websocket.send(
+            json.dumps(
+                {
+                    "backend_state": "running",
+                    "events": [self.event_to_json(event) for event in events],
+                }
+            )
+        )
+
+    def event_to_json(self, event: TaskEvent) -> JSON:
+        # Sends a streamed response as partial_response_offset and the
+        # partial_response_suffix after it, rather than all of it on every chunk.
+        event_json = event.to_json()
+        task_json = event_json["task"]
+        key = (*event.path, task_json["task_id"])
+        partial_response = task_json.pop("partial_response", None)
+        if partial_response is not None:
+            offset = min(self.sent_partial_responses.get(key, 0), len(partial_response))
+            task_json["partial_response_offset"] = offset
+            task_json["partial_response_suffix"] = partial_response[offset:]
+            self.sent_partial_responses[key] = len(partial_response)
+        elif self.sent_partial_responses.pop(key, None) is not None:
+            # Done streaming; clear what the client has.
+            task_json["partial_response"] = None
+            task_json["partial_output"] = None
+        return event_json
+
     async def send_graph(
         self, websocket: WebSocketServerProtocol, state: str, graph: TaskGraph
     ) -> None:
@@ -11,6 +11,55 @@ export const BackendState = {
   WAITING: "waiting",
 };
 
+// Progress events carry only the part of a streaming task's response that was received
+// since the last one, from partial_response_offset on.
+const withPartialResponse = (task, taskData) => {
+  const {
+    partial_response_offset: offset,
+    partial_response_suffix: suffix,
+    ...rest
+  } = taskData;
+  if (offset === undefined) {
+    return rest;
+  }
+  const received = (task && task.partial_response) || "";
+  return { ...rest, partial_response: received.slice(0, offset) + suffix };
+};
+
+// Applies task change events from the backend to serialized graph data, copying only the
+// parts of the graph that change.
+const applyEvents = (graphData, events) => {
+  const newGraphData = { ...graphData, tasks: [...graphData.tasks] };
+  for (const event of events) {
+    let graph = newGraphData;
+    for (const parentTaskId of event.path) {
+      const index = graph.tasks.findIndex((t) => t.task_id === parentTaskId);
+      const parentTask = { ...graph.tasks[index] };
+      parentTask.subgraph = {
+        ...parentTask.subgraph,
+        tasks: [...parentTask.subgraph.tasks],
+      };
+      graph.tasks[index] = parentTask;
+      graph = parentTask.subgraph;
+    }
+
+    const index = graph.tasks.findIndex(
+      (t) => t.task_id === event.task.task_id
+    );
+    if (event.kind === "removed") {
+      if (index !== -1) {
+        graph.tasks.splice(index, 1);
+      }
+    } else if (index === -1) {
+      graph.tasks.push(withPartialResponse(null, event.task));
+    } else {
+      const task = graph.tasks[index];
+      graph.tasks[index] = { ...task, ...withPartialResponse(task, event.task) };
+    }
+  }
+  return newGraphData;
+};
+
 const useSession = (serverUrl) => {
   const [initialGraphData, setInitialGraphData] = useState(null);
   const [graphData, setGraphData] = useState(null);
@@ -41,7 +90,13 @@ const useSession = (serverUrl) => {
             break;
           case BackendState.RUNNING:
             setSessionState(SessionState.RUNNING);
-            setGraphData(parsedMessage.graph);
+            if (parsedMessage.events) {
+              setGraphData((currentGraphData) =>
+                applyEvents(currentGraphData, parsedMessage.events)
+              );
+            } else {
+              setGraphData(parsedMessage.graph);
+            }
             break;
           case BackendState.WAITING:
             setSessionState(SessionState.EDITING);
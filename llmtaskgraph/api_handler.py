@@ -5,32 +5,187 @@ from tenacity import (
     wait_random_exponential,
 )
 
-from typing import Any
+import time
+from contextlib import AbstractAsyncContextManager, nullcontext
+from typing import Any, AsyncIterator, Callable, Optional
 
+from llmtaskgraph.hedging import HedgingPolicy
+from llmtaskgraph.http_client import HttpClient
+from llmtaskgraph.instrumentation import record_api_call, record_retry
+from llmtaskgraph.rate_limiter import RateLimiter
 from llmtaskgraph.types import Prompt, JSON
 
 
+def to_messages(prompt: Prompt) -> list[dict[str, str]]:
+    # make sure messages is a list of objects with role and content keys
+    if not isinstance(prompt, list):
+        if isinstance(prompt, str):
+            prompt = {"role": "user", "content": prompt}
+        prompt = [prompt]
+    return prompt
+
+
+def estimate_tokens(messages: list[dict[str, str]], params: JSON) -> int:
+    # Rough upper bound used to reserve rate limit budget before the request is sent:
+    # ~4 characters per prompt token, plus the completion budget if one is given.
+    prompt_tokens = sum(len(message["content"]) // 4 + 4 for message in messages)
+    max_tokens = params.get("max_tokens")
+    n = params.get("n")
+    completion_tokens = max_tokens if isinstance(max_tokens, int) else 0
+    return prompt_tokens + completion_tokens * (n if isinstance(n, int) else 1)
+
+
 class OpenAiChatApiHandler:
     # todo: support batching
-    def __init__(self):
-        pass
+    def __init__(
+        self,
+        limiter: Optional[RateLimiter] = None,
+        hedging: Optional[HedgingPolicy] = None,
+        http_client: Optional[HttpClient] = None,
+        api_key: Optional[str] = None,
+        api_base: Optional[str] = None,
+        request_params: Optional[JSON] = None,
+    ):
+        # Without an api key or base, openai's globals are used.
+        self.api_key = api_key
+        self.api_base = api_base
+        # Sent with every request, overriding the task's params, e.g. an Azure
+        # deployment's api_type, api_version and engine.
+        self.request_params = request_params if request_params else {}
+        self.limiter = limiter if limiter else RateLimiter()
+        # Opt-in: send a duplicate of slow requests. Doesn't apply to streamed responses.
+        self.hedging = hedging
+        # Requests sent outside a TaskGraph.run, or with http_client set to None, go
+        # through openai's default: a new session, and connection, per request.
+        self.http_client: Optional[HttpClient] = (
+            http_client if http_client else HttpClient()
+        )
+
+    def set_limits(
+        self,
+        max_concurrent: Optional[int] = None,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+    ) -> None:
+        self.limiter = RateLimiter(
+            max_concurrent, requests_per_minute, tokens_per_minute
+        )
 
-    @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
     async def api_call(
         self,
         prompt: Prompt,
         params: JSON,
     ) -> str:
-        # make sure messages is a list of objects with role and content keys
-        if not isinstance(prompt, list):
-            if isinstance(prompt, str):
-                prompt = {"role": "user", "content": prompt}
-            prompt = [prompt]
-
-        # Todo: handle api calls elsewhere for request batching and retries
-        response: Any = await openai.ChatCompletion.acreate(  # type: ignore
-            messages=prompt,
-            **params,
+        return (await self.api_call_choices(prompt, params))[0]
+
+    def set_hedging(self, percentile: float = 95, budget: float = 0.05) -> None:
+        self.hedging = HedgingPolicy(percentile, budget)
+
+    def set_http_client(
+        self,
+        max_connections: int = 100,
+        max_connections_per_host: int = 0,
+        keepalive_timeout: float = 30.0,
+        connect_timeout: Optional[float] = 10.0,
+        request_timeout: Optional[float] = 600.0,
+    ) -> None:
+        # Takes effect from the next run.
+        self.http_client = HttpClient(
+            max_connections,
+            max_connections_per_host,
+            keepalive_timeout,
+            connect_timeout,
+            request_timeout,
         )
-        # Todo: handle n > 1
-        return response.choices[0].message.content
+
+    def open_session(self) -> AbstractAsyncContextManager[None]:
+        return self.http_client.open() if self.http_client else nullcontext()
+
+    async def _create(self, **kwargs: Any) -> Any:
+        # Sends the request through the pooled session, if a run has opened it. A
+        # request_timeout in the params overrides the client's.
+        if self.api_key:
+            kwargs["api_key"] = self.api_key
+        if self.api_base:
+            kwargs["api_base"] = self.api_base
+        kwargs.update(self.request_params)
+        if self.http_client is None:
+            return await openai.ChatCompletion.acreate(**kwargs)  # type: ignore
+        kwargs.setdefault("request_timeout", self.http_client.timeout())
+        token = openai.aiosession.set(self.http_client.session())
+        try:
+            return await openai.ChatCompletion.acreate(**kwargs)  # type: ignore
+        finally:
+            openai.aiosession.reset(token)
+
+    # Yields the response content in chunks as it is generated. Not retried, since part of
+    # the response may already have been consumed.
+    async def api_call_stream(
+        self,
+        prompt: Prompt,
+        params: JSON,
+        before_send: Optional[Callable[[], None]] = None,
+    ) -> AsyncIterator[str]:
+        messages = to_messages(prompt)
+        async with self.limiter.limit(estimate_tokens(messages, params)):
+            if before_send:
+                before_send()
+            start = time.perf_counter()
+            response: Any = await self._create(
+                messages=messages,
+                stream=True,
+                **params,
+            )
+            async for chunk in response:
+                content = chunk.choices[0].delta.get("content")
+                if content:
+                    yield content
+            # Streamed responses don't report token usage.
+            record_api_call(time.perf_counter() - start)
+
+    # Returns the content of every choice, one per requested sample (params["n"]).
+    @retry(
+        wait=wait_random_exponential(min=1, max=60),
+        stop=stop_after_attempt(6),
+        before_sleep=lambda _: record_retry(),
+    )
+    async def api_call_choices(
+        self,
+        prompt: Prompt,
+        params: JSON,
+    ) -> list[str]:
+        if self.hedging is None:
+            return await self.request(prompt, params)
+        return await self.hedging.run(lambda: self.request(prompt, params))
+
+    # A single attempt, without retries or hedging.
+    async def request(
+        self,
+        prompt: Prompt,
+        params: JSON,
+        before_send: Optional[Callable[[], None]] = None,
+    ) -> list[str]:
+        # Each attempt, including retries and hedges, waits for its own slot under the
+        # limits. before_send is called once it has one, and may raise to cancel it.
+        messages = to_messages(prompt)
+        estimated_tokens = estimate_tokens(messages, params)
+        async with self.limiter.limit(estimated_tokens):
+            if before_send:
+                before_send()
+            start = time.perf_counter()
+            response: Any = await self._create(
+                messages=messages,
+                **params,
+            )
+            latency = time.perf_counter() - start
+            usage = response.get("usage")
+            if usage:
+                self.limiter.record_tokens(usage["total_tokens"] - estimated_tokens)
+                record_api_call(
+                    latency,
+                    usage.get("prompt_tokens", 0),
+                    usage.get("completion_tokens", 0),
+                )
+            else:
+                record_api_call(latency)
+        return [choice.message.content for choice in response.choices]
@@ -0,0 +1,86 @@
+import asyncio
+from typing import AsyncIterator, Iterable, Optional
+
+from llmtaskgraph.types import JSONValue
+
+from .executors import CallbackExecutors
+from .function_registry import FunctionRegistry
+from .response_cache import ResponseCache
+from .subgraph_cache import SubgraphCache
+from .task_graph import TaskGraph
+
+
+class BatchResult:
+    # The outcome of running one instance of a batch's template graph.
+    def __init__(
+        self,
+        index: int,
+        graph: TaskGraph,
+        output: JSONValue = None,
+        error: Optional[BaseException] = None,
+    ):
+        # Position of the graph input in the batch's inputs.
+        self.index = index
+        self.graph = graph
+        self.output = output
+        self.error = error
+
+
+async def run_batch(
+    template: TaskGraph,
+    graph_inputs: Iterable[JSONValue],
+    function_registry: FunctionRegistry,
+    max_concurrent: int = 8,
+    response_cache: Optional[ResponseCache] = None,
+    executors: Optional[CallbackExecutors] = None,
+    subgraph_cache: Optional[SubgraphCache] = None,
+) -> AsyncIterator[BatchResult]:
+    # Runs a clone of `template` for every graph input, up to max_concurrent at a time, and
+    # yields each result as soon as its graph finishes. All instances share the function
+    # registry, and with it the api handlers' rate limiters, as well as the response and
+    # subgraph caches and callback executors. A failed instance is reported in its
+    # result's error and doesn't stop the batch. Inputs are consumed lazily, so they may
+    # be a generator.
+    owns_executors = executors is None
+    shared_executors = executors if executors else CallbackExecutors()
+    inputs = enumerate(graph_inputs)
+    running: dict[asyncio.Task[JSONValue], tuple[int, TaskGraph]] = {}
+
+    def start_next() -> bool:
+        next_input = next(inputs, None)
+        if next_input is None:
+            return False
+        index, graph_input = next_input
+        graph = template.clone()
+        graph.graph_input = graph_input
+        run = asyncio.create_task(
+            graph.run(
+                function_registry,
+                response_cache=response_cache,
+                executors=shared_executors,
+                subgraph_cache=subgraph_cache,
+            )
+        )
+        running[run] = (index, graph)
+        return True
+
+    try:
+        while len(running) < max_concurrent and start_next():
+            pass
+        while running:
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for run in done:
+                index, graph = running.pop(run)
+                start_next()
+                if run.exception() is None:
+                    yield BatchResult(index, graph, output=run.result())
+                else:
+                    yield BatchResult(index, graph, error=run.exception())
+    finally:
+        # Reached early if the consumer stops iterating.
+        for run in running:
+            run.cancel()
+        if running:
+            await asyncio.wait(running)
+        if owns_executors:
+            shared_executors.shutdown()
@@ -0,0 +1,332 @@
+# A compact binary alternative to saving traces with TaskGraph.to_json and the json
+# module. The graph's JSON is packed with msgpack, with repeated data factored out:
+# - tasks are stored as arrays of values, with the keys stored once per distinct schema;
+# - dependencies, created_by and output_task are indexes into the graph's task list;
+# - function ids are interned in a string table;
+# - task ids are stored as their prefix, interned, and counter (see task.new_task_id);
+# - uuid task ids and fingerprints are stored as raw bytes instead of hex strings.
+# Large payloads (outputs, prompts, responses and subgraphs) are stored separately from
+# the graph's structure, so that a trace can be opened without reading them, with
+# load(path, lazy=True). The file layout is:
+#   magic | flags | offset of the structure (8 bytes) | payloads... | structure
+# Loading rebuilds the same JSON and passes it to TaskGraph.from_json.
+import mmap
+import os
+import secrets
+import struct
+import zlib
+from functools import partial
+from typing import Any, Callable, Optional
+
+import msgpack
+
+from llmtaskgraph.types import JSON
+
+from .task_graph import TaskGraph
+
+MAGIC = b"LTG1"
+_COMPRESSED = 1
+_HEADER = struct.Struct("<4sBQ")
+# A payload stored outside the structure: msgpack ext data holding its offset and size,
+# loaded as an (offset, size) tuple. Nothing else in a trace loads as a tuple.
+_PAYLOAD_REF = 1
+_REF = struct.Struct("<QI")
+_Ref = tuple[int, int]
+# Payloads this small are stored inline; the reference would be about as big.
+_INLINE_LIMIT = 64
+
+_FUNCTION_ID_KEYS = {
+    "prompt_formatter_id",
+    "api_handler_id",
+    "output_parser_id",
+    "incremental_parser_id",
+    "callback_id",
+    "input_formatter_id",
+}
+_FINGERPRINT_KEYS = {
+    "fingerprint",
+    "prompt_fingerprint",
+    "request_fingerprint",
+    "graph_input_fingerprint",
+}
+_PAYLOAD_KEYS = {"output_data", "formatted_prompt", "response"}
+
+
+def dumps(graph: TaskGraph, compress: bool = False) -> bytes:
+    encoder = _Encoder(compress)
+    encoded_graph = encoder.graph(graph.to_json())
+    structure: bytes = msgpack.packb(
+        [encoder.strings, encoder.schemas, encoded_graph], use_bin_type=True
+    )
+    if compress:
+        structure = zlib.compress(structure)
+    flags = _COMPRESSED if compress else 0
+    header = _HEADER.pack(MAGIC, flags, _HEADER.size + encoder.payloads_size)
+    return b"".join([header, *encoder.payloads, structure])
+
+
+def loads(data: bytes) -> TaskGraph:
+    return _Decoder(data, lazy=False).load()
+
+
+def save(graph: TaskGraph, path: str, compress: bool = True) -> None:
+    # The trace is written to a temporary file that then replaces `path`, so that saving
+    # is atomic, and a graph lazily loaded from `path` can be saved back to it: its
+    # mapping keeps the old file's contents.
+    data = dumps(graph, compress)
+    temp_path = f"{path}.{secrets.token_hex(4)}.tmp"
+    try:
+        with open(temp_path, "xb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+def load(path: str, lazy: bool = False) -> TaskGraph:
+    # With lazy=True, only the structure of the graph is read up front. Each task's
+    # payloads are read from the file when they are first accessed, so the file must not
+    # change while the graph is in use.
+    with open(path, "rb") as f:
+        if not lazy:
+            return loads(f.read())
+        # The mapping stays valid after the file is closed.
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return _Decoder(data, lazy=True).load()
+
+
+def _encode_uuid(task_id: str) -> Any:
+    # Canonical uuid strings, from older traces, are stored as their 16 bytes.
+    if len(task_id) == 36 and task_id.count("-") == 4:
+        try:
+            encoded = bytes.fromhex(task_id.replace("-", ""))
+        except ValueError:
+            return task_id
+        if _decode_uuid(encoded) == task_id:
+            return encoded
+    return task_id
+
+
+def _decode_uuid(task_id: bytes) -> str:
+    hex = task_id.hex()
+    return f"{hex[:8]}-{hex[8:12]}-{hex[12:16]}-{hex[16:20]}-{hex[20:]}"
+
+
+class _Encoder:
+    def __init__(self, compress: bool):
+        self.compress = compress
+        self.strings: list[str] = []
+        self.string_indexes: dict[str, int] = {}
+        self.schemas: list[list[str]] = []
+        self.schema_indexes: dict[tuple[str, ...], int] = {}
+        self.payloads: list[bytes] = []
+        self.payloads_size = 0
+
+        # How to encode the value of each key that isn't stored as is, given the indexes
+        # of the tasks in the graph.
+        intern = lambda value, _: self.intern(value)
+        self.codecs: dict[str, Callable[[Any, dict[str, int]], Any]] = {
+            "task_id": lambda value, _: self.task_id(value),
+            "deps": lambda value, indexes: [indexes[dep] for dep in value],
+            "kwdeps": lambda value, indexes: {
+                name: indexes[dep] for name, dep in value.items()
+            },
+            "created_by": lambda value, indexes: indexes[value],
+            "subgraph": lambda value, _: self.store(self.pack(self.graph(value))),
+            "template": lambda value, _: self.task(value, {}),
+            # A MapTask's per-element state: partial task json.
+            "items": lambda value, _: [self.task(item, {}) for item in value],
+        }
+        self.codecs.update((key, intern) for key in _FUNCTION_ID_KEYS)
+        self.codecs.update(
+            (key, lambda value, _: bytes.fromhex(value)) for key in _FINGERPRINT_KEYS
+        )
+        self.codecs.update((key, self.payload) for key in _PAYLOAD_KEYS)
+
+    def intern(self, string: str) -> int:
+        index = self.string_indexes.get(string)
+        if index is None:
+            index = self.string_indexes[string] = len(self.strings)
+            self.strings.append(string)
+        return index
+
+    def task_id(self, task_id: str) -> Any:
+        prefix, _, counter = task_id.partition("-")
+        if len(prefix) == 16 and counter and "-" not in counter:
+            try:
+                count = int(counter, 16)
+            except ValueError:
+                return task_id
+            if f"{prefix}-{count:x}" == task_id:
+                return [self.intern(prefix), count]
+        return _encode_uuid(task_id)
+
+    def pack(self, value: Any) -> bytes:
+        return msgpack.packb(value, use_bin_type=True)
+
+    def payload(self, value: Any, _: dict[str, int]) -> Any:
+        packed = self.pack(value)
+        return value if len(packed) <= _INLINE_LIMIT else self.store(packed)
+
+    def store(self, packed: bytes) -> msgpack.ExtType:
+        # Appends a payload to the file and returns a reference to it.
+        if self.compress:
+            packed = zlib.compress(packed)
+        offset = _HEADER.size + self.payloads_size
+        self.payloads.append(packed)
+        self.payloads_size += len(packed)
+        return msgpack.ExtType(_PAYLOAD_REF, _REF.pack(offset, len(packed)))
+
+    def graph(self, graph_json: Any) -> list[Any]:
+        indexes = {
+            task_json["task_id"]: index
+            for index, task_json in enumerate(graph_json["tasks"])
+        }
+        output_task = graph_json["output_task"]
+        return [
+            [self.task(task_json, indexes) for task_json in graph_json["tasks"]],
+            graph_json["graph_input"],
+            indexes[output_task] if output_task is not None else None,
+        ]
+
+    def task(self, task_json: Any, indexes: dict[str, int]) -> list[Any]:
+        keys = tuple(task_json)
+        schema = self.schema_indexes.get(keys)
+        if schema is None:
+            schema = self.schema_indexes[keys] = len(self.schemas)
+            self.schemas.append(list(keys))
+        codecs = self.codecs
+        encoded = [schema]
+        for key, value in task_json.items():
+            codec = codecs.get(key)
+            encoded.append(
+                value if codec is None or value is None else codec(value, indexes)
+            )
+        return encoded
+
+
+class _Decoder:
+    def __init__(self, data: bytes | mmap.mmap, lazy: bool):
+        magic, flags, structure_offset = _HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a binary trace")
+        self.data = data
+        self.compressed = bool(flags & _COMPRESSED)
+        self.lazy = lazy
+        self.structure_offset = structure_offset
+        self.strings: list[str] = []
+        self.schemas: list[list[str]] = []
+
+        # Inverses of _Encoder.codecs, given the ids of the graph's tasks decoded so far.
+        string = lambda value, _: self.strings[value]
+        self.codecs: dict[str, Callable[[Any, list[str]], Any]] = {
+            "task_id": lambda value, _: self.task_id(value),
+            "deps": lambda value, task_ids: [task_ids[dep] for dep in value],
+            "kwdeps": lambda value, task_ids: {
+                name: task_ids[dep] for name, dep in value.items()
+            },
+            "created_by": lambda value, task_ids: task_ids[value],
+            "subgraph": lambda value, _: self.graph_json(self.read(value), None),
+            "template": lambda value, _: self.task(value, [], None),
+            "items": lambda value, _: [self.task(item, [], None) for item in value],
+        }
+        self.codecs.update((key, string) for key in _FUNCTION_ID_KEYS)
+        self.codecs.update(
+            (key, lambda value, _: value.hex()) for key in _FINGERPRINT_KEYS
+        )
+        self.codecs.update(
+            (key, lambda value, _: self.read_payload(value)) for key in _PAYLOAD_KEYS
+        )
+
+    def unpack(self, data: bytes | mmap.mmap) -> Any:
+        if self.compressed:
+            data = zlib.decompress(data)
+        return msgpack.unpackb(
+            data, raw=False, ext_hook=lambda _, ref: _REF.unpack(ref)
+        )
+
+    def task_id(self, value: Any) -> str:
+        if isinstance(value, list):
+            prefix, count = value
+            return f"{self.strings[prefix]}-{count:x}"
+        if isinstance(value, bytes):
+            return _decode_uuid(value)
+        return value
+
+    def read(self, ref: _Ref) -> Any:
+        offset, size = ref
+        return self.unpack(self.data[offset : offset + size])
+
+    def read_payload(self, value: Any) -> Any:
+        return self.read(value) if type(value) is tuple else value
+
+    def read_subgraph(self, graph: TaskGraph, task: Any, ref: _Ref) -> TaskGraph:
+        subgraph = self.graph(self.read(ref))
+        subgraph.parent_task = task
+        subgraph.parent_graph = graph
+        return subgraph
+
+    def load(self) -> TaskGraph:
+        self.strings, self.schemas, encoded_graph = self.unpack(
+            self.data[self.structure_offset :]
+        )
+        return self.graph(encoded_graph)
+
+    def graph(self, encoded: list[Any]) -> TaskGraph:
+        if not self.lazy:
+            return TaskGraph.from_json(self.graph_json(encoded, None))
+        # Tasks are built with placeholders for the payloads stored outside the
+        # structure, which are replaced by lazy attributes.
+        refs: list[dict[str, _Ref]] = []
+        graph = TaskGraph.from_json(self.graph_json(encoded, refs))
+        for task, task_refs in zip(graph.tasks, refs):
+            for key, ref in task_refs.items():
+                if key == "subgraph":
+                    task.load_lazily(key, partial(self.read_subgraph, graph, task, ref))
+                else:
+                    task.load_lazily(key, partial(self.read, ref))
+        return graph
+
+    def graph_json(
+        self, encoded: list[Any], refs: Optional[list[dict[str, _Ref]]]
+    ) -> JSON:
+        # With `refs`, payloads stored outside the structure aren't read; their
+        # references are added to it, one dict per task.
+        encoded_tasks, graph_input, output_task = encoded
+        task_ids: list[str] = []
+        tasks = []
+        for encoded_task in encoded_tasks:
+            task_refs: Optional[dict[str, _Ref]] = None
+            if refs is not None:
+                task_refs = {}
+                refs.append(task_refs)
+            tasks.append(self.task(encoded_task, task_ids, task_refs))
+        return {
+            "tasks": tasks,
+            "graph_input": graph_input,
+            "output_task": task_ids[output_task] if output_task is not None else None,
+        }
+
+    def task(
+        self,
+        encoded: list[Any],
+        task_ids: list[str],
+        refs: Optional[dict[str, _Ref]],
+    ) -> JSON:
+        codecs = self.codecs
+        task_json: JSON = {}
+        for key, value in zip(self.schemas[encoded[0]], encoded[1:]):
+            if refs is not None and type(value) is tuple:
+                refs[key] = value
+                empty_graph = {"tasks": [], "graph_input": None, "output_task": None}
+                task_json[key] = empty_graph if key == "subgraph" else None
+                continue
+            codec = codecs.get(key)
+            task_json[key] = (
+                value if codec is None or value is None else codec(value, task_ids)
+            )
+        if "task_id" in task_json:
+            task_ids.append(task_json["task_id"])  # type: ignore
+        return task_json
@@ -0,0 +1,44 @@
+import json
+import tempfile
+from typing import IO, Literal, Optional
+
+from llmtaskgraph.types import JSONValue
+
+
+class BlobStore:
+    # Append-only store of JSON values in a local file, with an in-memory index of where
+    # the latest value of each key is. Runs that release outputs spill them here.
+    def __init__(self, path: Optional[str] = None, min_bytes: int = 256):
+        # Without a path, the store is a temporary file, deleted when it is closed.
+        self.file: IO[bytes] = open(path, "w+b") if path else tempfile.TemporaryFile()
+        # Smaller values take less memory than their index entry, and aren't stored.
+        self.min_bytes = min_bytes
+        self.index: dict[str, tuple[int, int]] = {}
+        self.size = 0
+
+    def put(self, key: str, value: JSONValue) -> bool:
+        # Returns whether the value was stored.
+        data = json.dumps(value).encode()
+        if len(data) < self.min_bytes:
+            return False
+        self.file.seek(self.size)
+        self.file.write(data)
+        self.index[key] = (self.size, len(data))
+        self.size += len(data)
+        return True
+
+    def get(self, key: str) -> JSONValue:
+        offset, size = self.index[key]
+        self.file.seek(offset)
+        return json.loads(self.file.read(size))
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index
+
+    def close(self) -> None:
+        self.file.close()
+
+
+# What TaskGraph.run does with a task's output once every task that reads it has finished:
+# spill it to a BlobStore, from which it is read back if accessed again, or drop it.
+ReleasePolicy = BlobStore | Literal["drop"]
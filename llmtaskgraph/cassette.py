@@ -0,0 +1,72 @@
+import asyncio
+import json
+import os
+from collections import defaultdict
+from typing import Any, Callable
+
+from llmtaskgraph.function_registry import AnyApiHandler, FunctionRegistry
+from llmtaskgraph.response_cache import cache_key_for_name
+
+
+class CassetteMissError(LookupError):
+    pass
+
+
+class Cassette:
+    # Records api handler calls to a local file and replays them without network access.
+    # The file holds one JSON line per call: {"key": <hash of handler, prompt, params>,
+    # "response": <response>}. In replay mode, repeated identical calls receive the
+    # recorded responses in order, and the last one once they run out.
+    def __init__(
+        self,
+        path: str,
+        mode: str = "replay",
+        latency: float | Callable[[], float] = 0.0,
+    ):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.recordings: defaultdict[str, list[Any]] = defaultdict(list)
+        self.replay_counts: defaultdict[str, int] = defaultdict(int)
+        if mode == "replay" or os.path.exists(path):
+            self._load()
+
+    def _load(self) -> None:
+        with open(self.path) as f:
+            for line in f:
+                entry = json.loads(line)
+                self.recordings[entry["key"]].append(entry["response"])
+
+    def _record(self, key: str, response: Any) -> None:
+        self.recordings[key].append(response)
+        with open(self.path, "a") as f:
+            f.write(json.dumps({"key": key, "response": response}) + "\n")
+
+    def _replay(self, key: str) -> Any:
+        responses = self.recordings.get(key)
+        if not responses:
+            raise CassetteMissError(f"No recorded response for {key} in {self.path}")
+        index = min(self.replay_counts[key], len(responses) - 1)
+        self.replay_counts[key] += 1
+        return responses[index]
+
+    def wrap(self, name: str, handler: AnyApiHandler) -> AnyApiHandler:
+        async def wrapped_handler(prompt: Any, params: Any) -> Any:
+            key = cache_key_for_name(name, prompt, params)
+            if self.mode == "record":
+                response = await handler(prompt, params)
+                self._record(key, response)
+                return response
+
+            latency = self.latency() if callable(self.latency) else self.latency
+            if latency > 0:
+                await asyncio.sleep(latency)
+            return self._replay(key)
+
+        wrapped_handler.__name__ = handler.__name__
+        return wrapped_handler
+
+    def wrap_registry(self, function_registry: FunctionRegistry) -> FunctionRegistry:
+        return function_registry.wrap_api_handlers(self.wrap)
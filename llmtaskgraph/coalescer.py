@@ -0,0 +1,113 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+
+from llmtaskgraph.function_registry import FunctionId, FunctionRegistry
+from llmtaskgraph.instrumentation import TaskStats, current_task_stats
+from llmtaskgraph.rate_limiter import request_priority
+from llmtaskgraph.response_cache import cache_key
+from llmtaskgraph.types import JSON, Prompt
+
+
+class _Batch:
+    def __init__(self):
+        self.waiters: list[asyncio.Future[str]] = []
+        # The stats of each waiting task, which share the usage of the request.
+        self.waiter_stats: list[Optional[TaskStats]] = []
+        self.waiter_priorities: list[tuple[float, ...]] = []
+        self.request: Optional[asyncio.Task[None]] = None
+
+    def on_waiter_done(self, _: asyncio.Future[str]) -> None:
+        # Stop the request if every task waiting on it was cancelled.
+        if self.request is not None and all(w.done() for w in self.waiters):
+            self.request.cancel()
+
+
+class RequestCoalescer:
+    # Merges identical single-sample api calls made in the same event loop iteration
+    # into one request with n = k, and hands one choice to each caller. Only applies to
+    # api handlers registered with a sample_many variant; calls beyond the handler's
+    # max_samples are sent in further requests.
+    def __init__(self, function_registry: FunctionRegistry):
+        self.function_registry = function_registry
+        self.pending: dict[str, _Batch] = {}
+
+    async def api_call(
+        self,
+        api_handler_id: FunctionId[[Prompt, JSON], str],
+        prompt: Prompt,
+        params: JSON,
+    ) -> str:
+        sample_many = self.function_registry.get_sample_many(api_handler_id)
+        if sample_many is None or params.get("n", 1) != 1:
+            return await self.function_registry.get_api_handler(api_handler_id)(
+                prompt, params
+            )
+
+        loop = asyncio.get_running_loop()
+        key = cache_key(api_handler_id, prompt, params)
+        batch = self.pending.get(key)
+        if batch is None:
+            batch = self.pending[key] = _Batch()
+            # Runs after every task that is already ready has had a chance to join.
+            loop.call_soon(self._flush, key, batch, sample_many, prompt, params)
+
+        waiter: asyncio.Future[str] = loop.create_future()
+        waiter.add_done_callback(batch.on_waiter_done)
+        batch.waiters.append(waiter)
+        batch.waiter_stats.append(current_task_stats.get())
+        batch.waiter_priorities.append(request_priority.get())
+        if len(batch.waiters) >= self.function_registry.get_max_samples(api_handler_id):
+            # Full; send it now, and let later calls start another batch.
+            self._flush(key, batch, sample_many, prompt, params)
+        return await waiter
+
+    def _flush(
+        self,
+        key: str,
+        batch: _Batch,
+        sample_many: Callable[[Prompt, JSON], Awaitable[list[Any]]],
+        prompt: Prompt,
+        params: JSON,
+    ) -> None:
+        if batch.request is not None:
+            # Already sent when it filled up.
+            return
+        del self.pending[key]
+        batch.request = asyncio.create_task(
+            self._send(batch, sample_many, prompt, {**params, "n": len(batch.waiters)})
+        )
+
+    async def _send(
+        self,
+        batch: _Batch,
+        sample_many: Callable[[Prompt, JSON], Awaitable[list[Any]]],
+        prompt: Prompt,
+        params: JSON,
+    ) -> None:
+        # Usage is recorded for the whole request, then split between the waiting tasks.
+        request_stats = TaskStats()
+        current_task_stats.set(request_stats)
+        # The request is as urgent as the most urgent task waiting on it.
+        request_priority.set(min(batch.waiter_priorities))
+        try:
+            choices = await sample_many(prompt, params)
+            if len(choices) < len(batch.waiters):
+                raise ValueError(
+                    f"Requested {len(batch.waiters)} choices, received {len(choices)}"
+                )
+        except Exception as e:
+            self._share_stats(batch, request_stats)
+            for waiter in batch.waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+            return
+
+        self._share_stats(batch, request_stats)
+        for waiter, choice in zip(batch.waiters, choices):
+            if not waiter.done():
+                waiter.set_result(choice)
+
+    def _share_stats(self, batch: _Batch, request_stats: TaskStats) -> None:
+        for index, stats in enumerate(batch.waiter_stats):
+            if stats is not None:
+                stats.add_share(request_stats, len(batch.waiter_stats), index)
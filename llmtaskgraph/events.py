@@ -0,0 +1,74 @@
+import time
+from typing import TYPE_CHECKING, Callable
+
+from llmtaskgraph.types import JSON
+
+if TYPE_CHECKING:
+    from .task import Task
+
+
+TASK_CREATED = "created"
+TASK_STARTED = "started"
+# A streaming LLMTask received more of its response.
+TASK_PROGRESS = "progress"
+TASK_COMPLETED = "completed"
+TASK_FAILED = "failed"
+# A task was dropped from its graph, e.g. because the task that created it ran again.
+TASK_REMOVED = "removed"
+# A TaskGraphTask's subgraph was replaced by a finished copy from a SubgraphCache.
+TASK_RESTORED = "restored"
+
+
+class TaskEvent:
+    # A change to one task of a TaskGraph. `path` holds the ids of the TaskGraphTasks
+    # enclosing the task, outermost first; it is empty for tasks of the graph itself.
+    # `output_task` is set on the TASK_CREATED event of a task added as its graph's
+    # output task.
+    def __init__(
+        self,
+        kind: str,
+        task: "Task",
+        path: tuple[str, ...] = (),
+        output_task: bool = False,
+    ):
+        self.kind = kind
+        self.task = task
+        self.path = path
+        self.output_task = output_task
+        self.timestamp = time.time()
+
+    def in_subgraph_of(self, task_id: str) -> "TaskEvent":
+        event = TaskEvent(
+            self.kind, self.task, (task_id,) + self.path, self.output_task
+        )
+        event.timestamp = self.timestamp
+        return event
+
+    def to_json(self) -> JSON:
+        from llmtaskgraph.task import (
+            TaskGraphTask,
+        )  # Import here to avoid circular dependency
+
+        # Subgraphs are only included for new or restored tasks; other changes to them
+        # are reported as events of their own.
+        if isinstance(self.task, TaskGraphTask) and self.kind not in (
+            TASK_CREATED,
+            TASK_RESTORED,
+        ):
+            task_json = self.task.to_json(include_subgraph=False)
+        else:
+            task_json = self.task.to_json()
+        event_json: dict[str, JSON] = {
+            "kind": self.kind,
+            "path": list(self.path),
+            "task": task_json,
+        }
+        if self.output_task:
+            event_json["output_task"] = True
+        return event_json
+
+    def __repr__(self):
+        return f"TaskEvent({self.kind}, {self.task.task_id}, {self.path})"
+
+
+TaskListener = Callable[[TaskEvent], None]
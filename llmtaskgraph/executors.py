@@ -0,0 +1,54 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class CallbackExecutors:
+    # Thread and process pools for synchronous PythonTask callbacks registered with the
+    # "thread" or "process" execution policy. Pools are created on first use; pass your
+    # own executors to control their size or type.
+    def __init__(
+        self,
+        thread_pool: Optional[Executor] = None,
+        process_pool: Optional[Executor] = None,
+        max_threads: Optional[int] = None,
+        max_processes: Optional[int] = None,
+    ):
+        self.thread_pool = thread_pool
+        self.process_pool = process_pool
+        self.max_threads = max_threads
+        self.max_processes = max_processes
+        # Only pools created here are shut down here.
+        self.owned_pools: list[Executor] = []
+
+    async def run_in_thread(
+        self, func: Callable[..., T], *args: Any, **kwargs: Any
+    ) -> T:
+        if self.thread_pool is None:
+            self.thread_pool = ThreadPoolExecutor(self.max_threads)
+            self.owned_pools.append(self.thread_pool)
+        return await asyncio.get_running_loop().run_in_executor(
+            self.thread_pool, partial(func, *args, **kwargs)
+        )
+
+    async def run_in_process(
+        self, func: Callable[..., T], *args: Any, **kwargs: Any
+    ) -> T:
+        if self.process_pool is None:
+            self.process_pool = ProcessPoolExecutor(self.max_processes)
+            self.owned_pools.append(self.process_pool)
+        return await asyncio.get_running_loop().run_in_executor(
+            self.process_pool, partial(func, *args, **kwargs)
+        )
+
+    def shutdown(self) -> None:
+        for pool in self.owned_pools:
+            pool.shutdown(wait=False, cancel_futures=True)
+            if pool is self.thread_pool:
+                self.thread_pool = None
+            if pool is self.process_pool:
+                self.process_pool = None
+        self.owned_pools = []
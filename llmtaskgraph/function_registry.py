@@ -1,12 +1,17 @@
 import inspect
 import json
+from contextlib import AbstractAsyncContextManager, AsyncExitStack, asynccontextmanager
 from typing import (
     TYPE_CHECKING,
     Any,
+    AsyncIterator,
     Awaitable,
     Callable,
+    ClassVar,
     Concatenate,
     Generic,
+    Literal,
+    Optional,
     ParamSpec,
     TypeVar,
 )
@@ -19,14 +24,29 @@ from .api_handler import OpenAiChatApiHandler
 if TYPE_CHECKING:
     from .task_graph import GraphContext
 
-_api_handler = OpenAiChatApiHandler()
+# The handler behind openai_chat. Its rate limits are shared by every graph and subgraph
+# that uses openai_chat, e.g. openai_chat_handler.set_limits(max_concurrent=16).
+openai_chat_handler = OpenAiChatApiHandler()
 
 T = TypeVar("T", covariant=True)
 P = ParamSpec("P")
 Q = Concatenate["GraphContext", P]
+AnyApiHandler = Callable[..., Awaitable[Any]]
+# Where synchronous PythonTask callbacks run: on the event loop, in a thread pool, or in a
+# process pool owned by the TaskGraph run.
+ExecutionPolicy = Literal["inline", "thread", "process"]
+# Returns a context manager that keeps an api handler's connections open while entered.
+OpenSession = Callable[[], AbstractAsyncContextManager[None]]
+# The most choices OpenAI's chat completions endpoint returns for one request.
+DEFAULT_MAX_SAMPLES = 128
 
 
 class FunctionId(Generic[P, T]):
+    __slots__ = ("name", "func_return_type")
+
+    # FunctionIds loaded from JSON, by name. Every task referring to a function shares one.
+    _loaded: ClassVar[dict[str, "FunctionId[..., Any]"]] = {}
+
     def __init__(self, func: Callable[Q[P], T] | Callable[P, Awaitable[T]]):
         self.name: str = func.__name__
         func_return_type: Any | None = inspect.get_annotations(func).get("return")
@@ -36,7 +56,7 @@ class FunctionId(Generic[P, T]):
         return hash(self.name)
 
     def __eq__(self, other: Any) -> bool:
-        return self.name == other.name
+        return self is other or self.name == other.name
 
     def __repr__(self):
         return f"FunctionId({self.name})"
@@ -47,10 +67,12 @@ class FunctionId(Generic[P, T]):
     @classmethod
     def from_json(cls, json: JSONValue) -> "FunctionId[..., Any]":
         assert isinstance(json, str)
-        function_id: FunctionId[..., Any] = FunctionId(lambda: None)  # type: ignore
-
-        function_id.name = json
-
+        function_id = cls._loaded.get(json)
+        if function_id is None:
+            function_id = cls.__new__(cls)
+            function_id.name = json
+            function_id.func_return_type = Any  # type: ignore
+            cls._loaded[json] = function_id
         return function_id
 
 
@@ -65,35 +87,162 @@ def add_context(fn: Callable[P, T]) -> Callable[Q[P], T]:
 class FunctionRegistry:
     def __init__(self):
         self._registry: dict[FunctionId[..., Any], Callable[..., Any]] = {}
+        # Optional variants of api handlers that return all choices of an n > 1 request.
+        self._sample_many: dict[FunctionId[..., Any], Callable[..., Any]] = {}
+        # The most choices a sample_many variant may be asked for in one request.
+        self._max_samples: dict[FunctionId[..., Any], int] = {}
+        # Optional variants of api handlers that yield the response in chunks.
+        self._streams: dict[FunctionId[..., Any], Callable[..., Any]] = {}
+        self._api_handler_ids: set[FunctionId[..., Any]] = set()
+        # How synchronous callbacks are run; "inline" unless registered otherwise.
+        self._execution_policies: dict[FunctionId[..., Any], ExecutionPolicy] = {}
+        # The undecorated functions of "process" callbacks, which must be picklable.
+        self._process_callables: dict[FunctionId[..., Any], Callable[..., Any]] = {}
+        # Opens what an api handler holds open while a run uses it, e.g. its HttpClient.
+        self._sessions: dict[FunctionId[..., Any], OpenSession] = {}
+
+    def register(
+        self, func: Callable[Q[P], T], execution: ExecutionPolicy = "inline"
+    ) -> FunctionId[P, T]:
+        if execution == "process":
+            raise ValueError(
+                "Callbacks run in a process can't receive a GraphContext;"
+                " register them with register_no_context."
+            )
+        return self._register(func, execution)
+
+    def register_no_context(
+        self, func: Callable[P, T], execution: ExecutionPolicy = "inline"
+    ) -> FunctionId[P, T]:
+        function_id: FunctionId[P, T] = self._register(add_context(func), execution)
+        if execution == "process":
+            self._process_callables[function_id] = func
+        return function_id
 
-    def register(self, func: Callable[Q[P], T]) -> FunctionId[P, T]:
+    def _register(
+        self, func: Callable[Q[P], T], execution: ExecutionPolicy
+    ) -> FunctionId[P, T]:
         function_id = FunctionId[P, T](func)
         self._registry[function_id] = func
+        for table in self._metadata():
+            table.pop(function_id, None)
+        self._api_handler_ids.discard(function_id)
+        if execution != "inline":
+            self._execution_policies[function_id] = execution
         return function_id
 
-    def register_no_context(self, func: Callable[P, T]) -> FunctionId[P, T]:
-        return self.register(add_context(func))
-
-    def register_api_handler(self, func: Callable[P, Awaitable[T]]) -> FunctionId[P, T]:
+    def register_api_handler(
+        self,
+        func: Callable[P, Awaitable[T]],
+        sample_many: Optional[Callable[[Prompt, JSON], Awaitable[list[T]]]] = None,
+        stream: Optional[Callable[[Prompt, JSON], AsyncIterator[str]]] = None,
+        session: Optional[OpenSession] = None,
+        max_samples: int = DEFAULT_MAX_SAMPLES,
+    ) -> FunctionId[P, T]:
         function_id = FunctionId[P, T](func)
         self._registry[function_id] = func
+        for table in self._metadata():
+            table.pop(function_id, None)
+        self._api_handler_ids.add(function_id)
+        if sample_many:
+            self._sample_many[function_id] = sample_many
+            self._max_samples[function_id] = max_samples
+        if stream:
+            self._streams[function_id] = stream
+        if session:
+            self._sessions[function_id] = session
         return function_id
 
+    def _metadata(self) -> list[dict[FunctionId[..., Any], Any]]:
+        return [
+            self._sample_many,
+            self._max_samples,
+            self._streams,
+            self._execution_policies,
+            self._process_callables,
+            self._sessions,
+        ]
+
     def copy(self) -> "FunctionRegistry":
         copy: FunctionRegistry = FunctionRegistry()
         copy._registry = self._registry.copy()
+        copy._sample_many = self._sample_many.copy()
+        copy._max_samples = self._max_samples.copy()
+        copy._streams = self._streams.copy()
+        copy._execution_policies = self._execution_policies.copy()
+        copy._process_callables = self._process_callables.copy()
+        copy._sessions = self._sessions.copy()
+        copy._api_handler_ids = self._api_handler_ids.copy()
         return copy
 
     def merge(self, other: "FunctionRegistry") -> "FunctionRegistry":
         merged: FunctionRegistry = self.copy()
         merged._registry.update(other._registry)
+        # Per-function metadata follows whichever registry the function came from.
+        for function_id in other._registry:
+            for table in merged._metadata():
+                table.pop(function_id, None)
+            merged._api_handler_ids.discard(function_id)
+        for table, other_table in zip(merged._metadata(), other._metadata()):
+            table.update(other_table)
+        merged._api_handler_ids.update(other._api_handler_ids)
         return merged
 
+    def wrap_api_handlers(
+        self,
+        wrapper: Callable[[str, AnyApiHandler], AnyApiHandler],
+    ) -> "FunctionRegistry":
+        # Returns a copy of this registry, including the base api handlers, in which every
+        # api handler and sample_many variant is replaced by wrapper(name, handler).
+        # Stream variants are dropped, so all calls go through the wrapped handlers.
+        wrapped: FunctionRegistry = make_base_registry().merge(self)
+        wrapped._streams = {}
+        for function_id in wrapped._api_handler_ids:
+            wrapped._registry[function_id] = wrapper(
+                function_id.name, wrapped._registry[function_id]
+            )
+            if function_id in wrapped._sample_many:
+                wrapped._sample_many[function_id] = wrapper(
+                    f"{function_id.name}/sample_many",
+                    wrapped._sample_many[function_id],
+                )
+        return wrapped
+
     def get_api_handler(
         self, function_id: FunctionId[P, T]
     ) -> Callable[P, Awaitable[T]]:
         return self._registry[function_id]  # type: ignore
 
+    def get_execution_policy(
+        self, function_id: FunctionId[..., Any]
+    ) -> ExecutionPolicy:
+        return self._execution_policies.get(function_id, "inline")
+
+    def get_process_callable(self, function_id: FunctionId[P, T]) -> Callable[P, T]:
+        return self._process_callables[function_id]
+
+    def get_sample_many(
+        self, function_id: FunctionId[P, T]
+    ) -> Optional[Callable[[Prompt, JSON], Awaitable[list[T]]]]:
+        return self._sample_many.get(function_id)
+
+    def get_max_samples(self, function_id: FunctionId[..., Any]) -> int:
+        return self._max_samples.get(function_id, DEFAULT_MAX_SAMPLES)
+
+    def get_stream(
+        self, function_id: FunctionId[..., Any]
+    ) -> Optional[Callable[[Prompt, JSON], AsyncIterator[str]]]:
+        return self._streams.get(function_id)
+
+    @asynccontextmanager
+    async def open_sessions(self) -> AsyncIterator[None]:
+        # Holds open the sessions of every api handler for the duration of a run. Handlers
+        # registered under several names are opened once.
+        async with AsyncExitStack() as stack:
+            for open_session in set(self._sessions.values()):
+                await stack.enter_async_context(open_session())
+            yield
+
     def __getitem__(self, function_id: FunctionId[P, T]) -> Callable[Q[P], T]:
         return self._registry[function_id]  # type: ignore
 
@@ -112,7 +261,10 @@ def _forward_graph_input(context: "GraphContext") -> JSONValue:
 
 _base_registry = FunctionRegistry()
 openai_chat: FunctionId[[Prompt, JSON], str] = _base_registry.register_api_handler(
-    _api_handler.api_call
+    openai_chat_handler.api_call,
+    sample_many=openai_chat_handler.api_call_choices,
+    stream=openai_chat_handler.api_call_stream,
+    session=openai_chat_handler.open_session,
 )
 dont_parse: FunctionId[[str], str] = _base_registry.register_no_context(_dont_parse)
 parse_json: FunctionId[[str], JSON] = _base_registry.register_no_context(_parse_json)
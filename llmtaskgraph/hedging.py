@@ -0,0 +1,71 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from llmtaskgraph.instrumentation import record_hedge
+
+T = TypeVar("T")
+
+
+class HedgingPolicy:
+    # Cuts tail latency by sending a duplicate of a request that is taking longer than
+    # `percentile` of recent requests, and taking whichever finishes first. Duplicates
+    # are capped at `budget` times the number of requests, and aren't sent until
+    # `min_samples` latencies have been observed.
+    def __init__(
+        self,
+        percentile: float = 95,
+        budget: float = 0.05,
+        window: int = 200,
+        min_samples: int = 20,
+    ):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.requests = 0
+        self.hedges = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        if len(self.latencies) < self.min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        index = math.ceil(self.percentile / 100 * len(ordered)) - 1
+        return ordered[max(0, min(index, len(ordered) - 1))]
+
+    def can_hedge(self) -> bool:
+        return self.hedges + 1 <= self.budget * self.requests
+
+    async def run(self, request: Callable[[], Awaitable[T]]) -> T:
+        # Awaits request(), calling it a second time if the first call is slow. The loser
+        # is cancelled. Fails only if every call fails, with the first call's error.
+        self.requests += 1
+        # Latencies are those of the whole request, from the first call to the first
+        # result: timing only calls that finish would leave out the slow ones that were
+        # cancelled, and hedge ever sooner.
+        start = time.perf_counter()
+        attempts = [asyncio.ensure_future(request())]
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=self.hedge_delay())
+            if not done and self.can_hedge():
+                self.hedges += 1
+                record_hedge()
+                attempts.append(asyncio.ensure_future(request()))
+
+            pending = set(attempts)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for attempt in done:
+                    if attempt.exception() is None:
+                        self.latencies.append(time.perf_counter() - start)
+                        return attempt.result()
+            return attempts[0].result()
+        finally:
+            for attempt in attempts:
+                if not attempt.cancel() and not attempt.cancelled():
+                    # Already finished; retrieve a losing attempt's error so it isn't logged.
+                    attempt.exception()
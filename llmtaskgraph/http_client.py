@@ -0,0 +1,57 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import aiohttp
+
+
+class HttpClient:
+    # A pooled aiohttp session shared by an api handler's requests, so that they reuse
+    # kept-alive connections instead of each opening, and TLS-handshaking, its own. The
+    # session is created by the first request of the first TaskGraph.run that uses the
+    # handler, and closed when the last such run ends; see FunctionRegistry.open_sessions.
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_connections_per_host: int = 0,
+        keepalive_timeout: float = 30.0,
+        connect_timeout: Optional[float] = 10.0,
+        request_timeout: Optional[float] = 600.0,
+    ):
+        # 0 means no limit. Requests beyond the limits wait for a free connection.
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        # How long idle connections are kept open for reuse.
+        self.keepalive_timeout = keepalive_timeout
+        # Deadlines of each request: to connect, and for the whole response.
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.users = 0
+
+    def timeout(self) -> tuple[Optional[float], Optional[float]]:
+        return (self.connect_timeout, self.request_timeout)
+
+    def session(self) -> Optional[aiohttp.ClientSession]:
+        # None outside of a run.
+        if self.users == 0:
+            return None
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_connections,
+                    limit_per_host=self.max_connections_per_host,
+                    keepalive_timeout=self.keepalive_timeout,
+                )
+            )
+        return self._session
+
+    @asynccontextmanager
+    async def open(self) -> AsyncIterator[None]:
+        self.users += 1
+        try:
+            yield
+        finally:
+            self.users -= 1
+            if self.users == 0 and self._session is not None:
+                session, self._session = self._session, None
+                await session.close()
@@ -0,0 +1,137 @@
+import time
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from llmtaskgraph.types import JSON, JSONValue
+
+from .events import TASK_COMPLETED, TASK_FAILED, TaskEvent, TaskListener
+
+
+class TaskStats:
+    # Timing and API usage of one task. Timestamps are seconds since the epoch and are
+    # reset every time the task is run; API usage accumulates over every call the task
+    # actually made.
+    __slots__ = (
+        "queued_at",
+        "ready_at",
+        "started_at",
+        "completed_at",
+        "api_calls",
+        "api_latency_s",
+        "retries",
+        "hedges",
+        "prompt_tokens",
+        "completion_tokens",
+    )
+
+    def __init__(self):
+        # Added to a running graph, waiting on dependencies.
+        self.queued_at: Optional[float] = None
+        # All dependencies finished.
+        self.ready_at: Optional[float] = None
+        self.started_at: Optional[float] = None
+        self.completed_at: Optional[float] = None
+
+        self.api_calls = 0
+        self.api_latency_s = 0.0
+        self.retries = 0
+        # Duplicate requests sent by a HedgingPolicy.
+        self.hedges = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def reset_timing(self) -> None:
+        self.queued_at = time.time()
+        self.ready_at = None
+        self.started_at = None
+        self.completed_at = None
+
+    def add_share(self, other: "TaskStats", shares: int = 1, index: int = 0) -> None:
+        # Adds share number `index` of `shares` of API usage recorded for a request made
+        # for several tasks. Counts are split so that the shares add up to the whole: the
+        # request itself is counted for the first task only, and leftover tokens go to the
+        # first few tasks.
+        def share(total: int) -> int:
+            return total // shares + (1 if index < total % shares else 0)
+
+        self.api_calls += share(other.api_calls)
+        self.api_latency_s += other.api_latency_s / shares
+        self.retries += share(other.retries)
+        self.hedges += share(other.hedges)
+        self.prompt_tokens += share(other.prompt_tokens)
+        self.completion_tokens += share(other.completion_tokens)
+
+    def to_json(self) -> JSON:
+        return {
+            "queued_at": self.queued_at,
+            "ready_at": self.ready_at,
+            "started_at": self.started_at,
+            "completed_at": self.completed_at,
+            "api_calls": self.api_calls,
+            "api_latency_s": self.api_latency_s,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
+
+    @classmethod
+    def from_json(cls, json: Optional[JSONValue]) -> "TaskStats":
+        stats = cls()
+        if isinstance(json, dict):
+            for key, value in json.items():
+                if hasattr(stats, key):
+                    setattr(stats, key, value)
+        return stats
+
+
+# The stats of the task whose code is currently running; set by Task.run.
+current_task_stats: ContextVar[Optional[TaskStats]] = ContextVar(
+    "current_task_stats", default=None
+)
+
+
+def record_api_call(
+    latency_s: float, prompt_tokens: int = 0, completion_tokens: int = 0
+) -> None:
+    # For api handlers: attributes one request to the task that made it.
+    stats = current_task_stats.get()
+    if stats is not None:
+        stats.api_calls += 1
+        stats.api_latency_s += latency_s
+        stats.prompt_tokens += prompt_tokens
+        stats.completion_tokens += completion_tokens
+
+
+def record_retry() -> None:
+    stats = current_task_stats.get()
+    if stats is not None:
+        stats.retries += 1
+
+
+def record_hedge() -> None:
+    stats = current_task_stats.get()
+    if stats is not None:
+        stats.hedges += 1
+
+
+def span_listener(export: Callable[[JSON], None]) -> TaskListener:
+    # Adapts a span exporter into a TaskGraph listener. Each finished task is exported
+    # once as a span: its ids, timing, status and API usage.
+    def listener(event: TaskEvent) -> None:
+        if event.kind not in (TASK_COMPLETED, TASK_FAILED):
+            return
+        task = event.task
+        export(
+            {
+                "task_id": task.task_id,
+                "parent_task_ids": list(event.path),
+                "type": task.__class__.__name__,
+                "status": "error" if event.kind == TASK_FAILED else "ok",
+                "start": task.stats.started_at,
+                "end": task.stats.completed_at,
+                "attributes": task.stats.to_json(),
+            }
+        )
+
+    return listener
@@ -0,0 +1,94 @@
+import json
+import os
+from typing import Any, Optional, TextIO
+
+from llmtaskgraph.types import JSON
+
+from .events import TASK_PROGRESS, TASK_REMOVED, TASK_STARTED, TaskEvent
+from .task_graph import TaskGraph
+
+
+class Journal:
+    # An append-only log of task events: one JSON line per task added, output produced or
+    # error, written as each happens. Pass one to TaskGraph.run to checkpoint a graph
+    # continuously, and rebuild it after a crash with load_journal.
+    def __init__(self, path: str, fsync: bool = False):
+        self.path = path
+        self.fsync = fsync
+        self.file: Optional[TextIO] = None
+
+    def record(self, event: TaskEvent) -> None:
+        # Progress events each repeat the whole partial response so far; the completed
+        # event records the final one.
+        if event.kind in (TASK_STARTED, TASK_PROGRESS):
+            return
+        if self.file is None:
+            self.file = open(self.path, "a")
+        self.file.write(json.dumps(event.to_json(), separators=(",", ":")) + "\n")
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def load_journal(base_snapshot: JSON, path: str) -> TaskGraph:
+    # Rebuilds a TaskGraph from a snapshot taken with TaskGraph.to_json plus the journal
+    # records written since. Records already reflected in the snapshot are harmless.
+    snapshot: Any = json.loads(json.dumps(base_snapshot))
+
+    # Task json objects by their path of enclosing TaskGraphTask ids and their own id.
+    tasks: dict[tuple[str, ...], Any] = {}
+    graphs: dict[tuple[str, ...], Any] = {(): snapshot}
+
+    def index_graph(graph_json: Any, path: tuple[str, ...]) -> None:
+        graphs[path] = graph_json
+        for task_json in graph_json["tasks"]:
+            index_task(task_json, path)
+
+    def index_task(task_json: Any, path: tuple[str, ...]) -> None:
+        task_path = path + (task_json["task_id"],)
+        tasks[task_path] = task_json
+        if "subgraph" in task_json:
+            index_graph(task_json["subgraph"], task_path)
+
+    index_graph(snapshot, ())
+
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A torn final line from a crash mid-write.
+                break
+            path_ids = tuple(record["path"])
+            task_json = record["task"]
+            task_path = path_ids + (task_json["task_id"],)
+            graph_json = graphs[path_ids]
+            if record["kind"] == TASK_REMOVED:
+                removed = tasks.pop(task_path, None)
+                if removed is not None:
+                    graph_json["tasks"].remove(removed)
+                if graph_json["output_task"] == task_json["task_id"]:
+                    graph_json["output_task"] = None
+                continue
+            if record.get("output_task"):
+                graph_json["output_task"] = task_json["task_id"]
+            existing = tasks.get(task_path)
+            if existing is None:
+                graph_json["tasks"].append(task_json)
+            else:
+                existing.update(task_json)
+                task_json = existing
+            if "subgraph" in record["task"]:
+                index_task(task_json, path_ids)
+            else:
+                tasks[task_path] = task_json
+            # A TaskGraphTask's input is passed on to its subgraph when it runs.
+            if "subgraph" in task_json and task_json["graph_input"] is not None:
+                graphs[task_path]["graph_input"] = task_json["graph_input"]
+
+    return TaskGraph.from_json(snapshot)
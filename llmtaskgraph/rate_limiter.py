@@ -0,0 +1,163 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Optional
+
+# Priority of requests made from the current context; lower values are served first.
+# Set by the scheduler for each task it starts.
+request_priority: ContextVar[tuple[float, ...]] = ContextVar(
+    "request_priority", default=()
+)
+
+
+class _Budget:
+    # A token bucket holding up to `per_minute` units, refilled continuously.
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def clamp(self, amount: int) -> float:
+        # Requests larger than the whole budget would otherwise wait forever.
+        return min(float(amount), self.capacity)
+
+    def seconds_until(self, amount: int) -> float:
+        return max(0.0, (self.clamp(amount) - self.level) / self.rate)
+
+    def spend(self, amount: float) -> None:
+        # May go negative when actual usage exceeds the estimate; later requests wait it out.
+        self.level -= amount
+
+
+class RateLimiter:
+    # Limits concurrent requests, requests per minute and tokens per minute for one api
+    # handler. Waiters are served in order of request_priority, then in FIFO order. Every
+    # limit is optional; with no limits set, acquiring never waits.
+    def __init__(
+        self,
+        max_concurrent: Optional[int] = None,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+    ):
+        self.max_concurrent = max_concurrent
+        self.requests = _Budget(requests_per_minute) if requests_per_minute else None
+        self.tokens = _Budget(tokens_per_minute) if tokens_per_minute else None
+
+        self.in_flight = 0
+        # Heap of (priority, arrival order, tokens, waiter).
+        self.waiters: list[
+            tuple[tuple[float, ...], int, int, asyncio.Future[None]]
+        ] = []
+        self.arrivals = itertools.count()
+        self.timer: Optional[asyncio.TimerHandle] = None
+        # The event loop that waiters and the timer belong to. Limiters can outlive it,
+        # e.g. those of the module-level openai_chat handler across asyncio.run calls.
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @asynccontextmanager
+    async def limit(self, tokens: int) -> AsyncIterator[None]:
+        await self.acquire(tokens)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, tokens: int) -> None:
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            # Requests still queued or in flight on the previous loop will never finish,
+            # and its timer will never fire.
+            self.loop = loop
+            self.waiters = []
+            self.in_flight = 0
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+        if not self.waiters and self._try_take(tokens):
+            return
+
+        waiter = loop.create_future()
+        heapq.heappush(
+            self.waiters,
+            (request_priority.get(), next(self.arrivals), tokens, waiter),
+        )
+        self._wake()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if not waiter.cancelled():
+                # We were granted a slot just as we were cancelled; give it back.
+                self.release()
+            else:
+                # The cancelled waiter is dropped from the heap when it reaches the top.
+                self._wake()
+            raise
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    def record_tokens(self, extra_tokens: int) -> None:
+        # Corrects the token budget once actual usage is known.
+        if self.tokens is not None:
+            self.tokens.refill()
+            self.tokens.spend(extra_tokens)
+
+    def _try_take(self, tokens: int) -> bool:
+        if self.max_concurrent is not None and self.in_flight >= self.max_concurrent:
+            return False
+        if self._seconds_until_available(tokens) > 0:
+            return False
+
+        if self.requests is not None:
+            self.requests.spend(1)
+        if self.tokens is not None:
+            self.tokens.spend(self.tokens.clamp(tokens))
+        self.in_flight += 1
+        return True
+
+    def _seconds_until_available(self, tokens: int) -> float:
+        delay = 0.0
+        if self.requests is not None:
+            self.requests.refill()
+            delay = max(delay, self.requests.seconds_until(1))
+        if self.tokens is not None:
+            self.tokens.refill()
+            delay = max(delay, self.tokens.seconds_until(tokens))
+        return delay
+
+    def _wake(self) -> None:
+        while self.waiters:
+            _, _, tokens, waiter = self.waiters[0]
+            if waiter.done():
+                heapq.heappop(self.waiters)
+                continue
+            if not self._try_take(tokens):
+                break
+            heapq.heappop(self.waiters)
+            waiter.set_result(None)
+
+        if not self.waiters or self.timer is not None:
+            return
+        if self.max_concurrent is not None and self.in_flight >= self.max_concurrent:
+            # A release will wake us up.
+            return
+        # Blocked on a per-minute budget; check again once it has refilled enough.
+        _, _, tokens, _ = self.waiters[0]
+        self.timer = asyncio.get_running_loop().call_later(
+            self._seconds_until_available(tokens), self._on_timer
+        )
+
+    def _on_timer(self) -> None:
+        self.timer = None
+        self._wake()
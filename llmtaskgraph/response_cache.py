@@ -0,0 +1,198 @@
+import hashlib
+import json
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, defaultdict
+from typing import Any, Optional
+
+from llmtaskgraph.function_registry import FunctionId
+from llmtaskgraph.types import JSON, Prompt
+
+
+def cache_key(
+    api_handler_id: FunctionId[..., Any],
+    prompt: Prompt,
+    params: JSON,
+    occurrence: int = 0,
+) -> str:
+    return cache_key_for_name(api_handler_id.name, prompt, params, occurrence)
+
+
+def cache_key_for_name(
+    api_handler_name: str, prompt: Prompt, params: JSON, occurrence: int = 0
+) -> str:
+    # `occurrence` tells apart repeated identical requests; see RequestOccurrences.
+    key_data: list[Any] = [api_handler_name, prompt, params]
+    if occurrence:
+        key_data.append(occurrence)
+    encoded = json.dumps(key_data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class RequestOccurrences:
+    # Numbers the identical requests made during one run, starting from 0, so that
+    # identical sampling tasks (temperature > 0) are cached, and replayed from the cache,
+    # as distinct samples, like a Cassette replays repeated calls in order. Requests
+    # with temperature 0 are deterministic, and all share occurrence 0.
+    def __init__(self):
+        self.counts: defaultdict[str, int] = defaultdict(int)
+
+    def next(
+        self, api_handler_id: FunctionId[..., Any], prompt: Prompt, params: JSON
+    ) -> int:
+        if params.get("temperature") == 0:
+            return 0
+        key = cache_key(api_handler_id, prompt, params)
+        occurrence = self.counts[key]
+        self.counts[key] += 1
+        return occurrence
+
+
+class CacheBackend(ABC):
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def put(self, key: str, value: str) -> None:
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    # Least-recently-used eviction once stored values exceed max_bytes.
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: OrderedDict[str, str] = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous)
+        self.entries[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes and self.entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+
+class SqliteCacheBackend(CacheBackend):
+    # Persists responses in a local SQLite file, evicting the least recently used
+    # entries once stored values exceed max_bytes.
+    def __init__(self, path: str, max_bytes: int = 1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)"
+        )
+        self.connection.commit()
+        (size,) = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        self.size: int = size
+        self._evict()
+        self.connection.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        row = self.connection.execute(
+            "SELECT value FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        self.connection.execute(
+            "UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key)
+        )
+        self.connection.commit()
+        return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        previous = self.connection.execute(
+            "SELECT size FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if previous is not None:
+            self.size -= previous[0]
+        self.connection.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+            (key, value, len(value), time.time()),
+        )
+        self.size += len(value)
+        self._evict()
+        self.connection.commit()
+
+    def _evict(self) -> None:
+        if self.size <= self.max_bytes:
+            return
+        evicted: list[str] = []
+        for key, size in self.connection.execute(
+            "SELECT key, size FROM responses ORDER BY last_used"
+        ):
+            evicted.append(key)
+            self.size -= size
+            if self.size <= self.max_bytes:
+                break
+        self.connection.executemany(
+            "DELETE FROM responses WHERE key = ?", [(key,) for key in evicted]
+        )
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class ResponseCache:
+    # Opt-in cache of api handler responses, keyed by a hash of the handler id,
+    # formatted prompt and params, and the request's occurrence in its run. Lookups go
+    # to an in-memory LRU tier first, then to the optional persistent backend.
+    def __init__(
+        self,
+        backend: Optional[CacheBackend] = None,
+        memory: Optional[MemoryCacheBackend] = None,
+    ):
+        self.memory = memory if memory else MemoryCacheBackend()
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self,
+        api_handler_id: FunctionId[..., Any],
+        prompt: Prompt,
+        params: JSON,
+        occurrence: int = 0,
+    ) -> Optional[str]:
+        key = cache_key(api_handler_id, prompt, params, occurrence)
+        value = self.memory.get(key)
+        if value is None and self.backend is not None:
+            value = self.backend.get(key)
+            if value is not None:
+                self.memory.put(key, value)
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(
+        self,
+        api_handler_id: FunctionId[..., Any],
+        prompt: Prompt,
+        params: JSON,
+        response: str,
+        occurrence: int = 0,
+    ) -> None:
+        key = cache_key(api_handler_id, prompt, params, occurrence)
+        self.memory.put(key, response)
+        if self.backend is not None:
+            self.backend.put(key, response)
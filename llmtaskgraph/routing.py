@@ -0,0 +1,279 @@
+import random
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from functools import partial
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Literal,
+    Optional,
+    Sequence,
+    TypeVar,
+)
+
+import openai
+from tenacity import (
+    retry,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+from llmtaskgraph.api_handler import OpenAiChatApiHandler
+from llmtaskgraph.instrumentation import record_retry
+from llmtaskgraph.types import JSON, Prompt
+
+T = TypeVar("T")
+
+# How a RoutingApiHandler picks a backend for each request: the one with the fewest
+# requests in flight relative to its weight, or at random in proportion to the weights.
+RoutingPolicy = Literal["least_outstanding", "weighted"]
+
+
+def is_backend_failure(error: BaseException) -> bool:
+    # Errors that another backend may not have: rate limits, server errors, timeouts,
+    # connection errors and rejected keys. Errors in the request itself aren't.
+    if isinstance(
+        error,
+        (
+            openai.error.RateLimitError,
+            openai.error.ServiceUnavailableError,
+            openai.error.Timeout,
+            openai.error.APIConnectionError,
+            openai.error.TryAgain,
+            openai.error.AuthenticationError,
+            openai.error.PermissionError,
+        ),
+    ):
+        return True
+    if isinstance(error, openai.error.APIError):
+        return error.http_status is None or error.http_status >= 500
+    return False
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    # The delay asked for by a 429 response's Retry-After header, in seconds.
+    if not isinstance(error, openai.error.RateLimitError) or not error.headers:
+        return None
+    try:
+        return float(error.headers.get("retry-after", ""))
+    except ValueError:
+        return None
+
+
+class BackendEjected(Exception):
+    # Raised for a request that was waiting for a backend's rate limits when the backend
+    # was ejected, so it is sent elsewhere.
+    pass
+
+
+class Backend:
+    # One of a RoutingApiHandler's backends, e.g. an api key or deployment, with its own
+    # rate limits and connection pool, and its health.
+    def __init__(
+        self,
+        handler: OpenAiChatApiHandler,
+        weight: float = 1.0,
+        name: Optional[str] = None,
+    ):
+        self.handler = handler
+        self.weight = weight
+        self.name = name if name else handler.api_base or "default"
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        # Not sent requests until then, by time.monotonic().
+        self.ejected_until = 0.0
+        self.ejections = 0
+
+    def __repr__(self):
+        return f"Backend({self.name})"
+
+
+class RoutingApiHandler:
+    # Spreads requests across several backends, so that their combined throughput can
+    # go past any one key's rate limits. A request that fails with a backend failure
+    # (see is_backend_failure) is sent again to another backend, until every backend
+    # has been tried. A backend that fails failure_threshold requests in a row is
+    # ejected for `cooldown` seconds, or as long as a 429 response asks; after that,
+    # one request at a time is let through until one succeeds.
+    def __init__(
+        self,
+        backends: Sequence[OpenAiChatApiHandler | Backend],
+        policy: RoutingPolicy = "least_outstanding",
+        failure_threshold: int = 3,
+        cooldown: float = 30.0,
+        is_failure: Callable[[BaseException], bool] = is_backend_failure,
+        seed: Optional[int] = None,
+    ):
+        if not backends:
+            raise ValueError("RoutingApiHandler needs at least one backend")
+        self.backends = [
+            backend if isinstance(backend, Backend) else Backend(backend)
+            for backend in backends
+        ]
+        self.policy = policy
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.is_failure = is_failure
+        self.rng = random.Random(seed)
+
+    def available(self, backend: Backend, now: float) -> bool:
+        if backend.ejected_until > now:
+            return False
+        # Half-open: a backend coming back from an ejection gets one probe at a time.
+        recovering = backend.consecutive_failures >= self.failure_threshold
+        return not recovering or backend.outstanding == 0
+
+    def choose(self, tried: set[Backend]) -> Optional[Backend]:
+        untried = [backend for backend in self.backends if backend not in tried]
+        if not untried:
+            return None
+        now = time.monotonic()
+        candidates = [backend for backend in untried if self.available(backend, now)]
+        if not candidates:
+            # Rather than failing without sending the request, try the backend that
+            # recovers soonest.
+            return min(untried, key=lambda backend: backend.ejected_until)
+        if self.policy == "weighted":
+            weights = [backend.weight for backend in candidates]
+            return self.rng.choices(candidates, weights)[0]
+        return min(
+            candidates,
+            key=lambda backend: (
+                (backend.outstanding + 1) / backend.weight,
+                backend.requests / backend.weight,
+            ),
+        )
+
+    def record_success(self, backend: Backend) -> None:
+        backend.consecutive_failures = 0
+        backend.ejected_until = 0.0
+
+    def record_failure(self, backend: Backend, error: BaseException) -> None:
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        now = time.monotonic()
+        ejected_until = backend.ejected_until
+        if backend.consecutive_failures >= self.failure_threshold:
+            ejected_until = max(ejected_until, now + self.cooldown)
+        delay = retry_after(error)
+        if delay is not None:
+            ejected_until = max(ejected_until, now + delay)
+        if ejected_until > backend.ejected_until:
+            if backend.ejected_until <= now:
+                backend.ejections += 1
+            backend.ejected_until = ejected_until
+
+    def start_request(self, backend: Backend, ejections: int) -> None:
+        # Called once a request has its turn under the backend's rate limits. Requests
+        # queued before the backend was ejected are sent elsewhere instead.
+        if backend.ejections != ejections:
+            raise BackendEjected(backend.name)
+        backend.requests += 1
+
+    async def route(
+        self, send: Callable[[Backend, Callable[[], None]], Awaitable[T]]
+    ) -> T:
+        # Calls send(backend, before_send) on backends until one succeeds.
+        tried: set[Backend] = set()
+        last_error: Optional[Exception] = None
+        while True:
+            backend = self.choose(tried)
+            if backend is None:
+                # Every backend has been tried, and failed.
+                assert last_error is not None
+                raise last_error
+            if tried:
+                record_retry()
+            tried.add(backend)
+            backend.outstanding += 1
+            before_send = partial(self.start_request, backend, backend.ejections)
+            try:
+                result = await send(backend, before_send)
+            except BackendEjected as error:
+                last_error = error
+                continue
+            except Exception as error:
+                if not self.is_failure(error):
+                    raise
+                self.record_failure(backend, error)
+                last_error = error
+                continue
+            finally:
+                backend.outstanding -= 1
+            self.record_success(backend)
+            return result
+
+    async def api_call(
+        self,
+        prompt: Prompt,
+        params: JSON,
+    ) -> str:
+        return (await self.api_call_choices(prompt, params))[0]
+
+    # Retried with backoff if every backend fails, like OpenAiChatApiHandler.
+    @retry(
+        wait=wait_random_exponential(min=1, max=60),
+        stop=stop_after_attempt(6),
+        before_sleep=lambda _: record_retry(),
+    )
+    async def api_call_choices(
+        self,
+        prompt: Prompt,
+        params: JSON,
+    ) -> list[str]:
+        return await self.route(
+            lambda backend, before_send: backend.handler.request(
+                prompt, params, before_send
+            )
+        )
+
+    # Fails over only until the first chunk has been received.
+    async def api_call_stream(
+        self,
+        prompt: Prompt,
+        params: JSON,
+    ) -> AsyncIterator[str]:
+        tried: set[Backend] = set()
+        last_error: Optional[Exception] = None
+        while True:
+            backend = self.choose(tried)
+            if backend is None:
+                # Every backend has been tried, and failed.
+                assert last_error is not None
+                raise last_error
+            if tried:
+                record_retry()
+            tried.add(backend)
+            backend.outstanding += 1
+            received = False
+            before_send = partial(self.start_request, backend, backend.ejections)
+            try:
+                async for chunk in backend.handler.api_call_stream(
+                    prompt, params, before_send
+                ):
+                    received = True
+                    yield chunk
+            except BackendEjected as error:
+                last_error = error
+                continue
+            except Exception as error:
+                if received or not self.is_failure(error):
+                    raise
+                self.record_failure(backend, error)
+                last_error = error
+                continue
+            finally:
+                backend.outstanding -= 1
+            self.record_success(backend)
+            return
+
+    @asynccontextmanager
+    async def open_session(self) -> AsyncIterator[None]:
+        # Opens the connection pools of all the backends.
+        async with AsyncExitStack() as stack:
+            for backend in self.backends:
+                await stack.enter_async_context(backend.handler.open_session())
+            yield
@@ -0,0 +1,260 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import defaultdict
+from functools import partial
+from typing import TYPE_CHECKING, Optional
+
+from .blob_store import BlobStore, ReleasePolicy
+from .events import TASK_COMPLETED, TASK_FAILED, TASK_STARTED, TaskEvent
+from .function_registry import FunctionRegistry
+from .rate_limiter import request_priority
+from .task import MapTask, Task, TaskGraphTask
+
+if TYPE_CHECKING:
+    from .task_graph import TaskGraph
+
+
+class Scheduler:
+    # Starts each task of a TaskGraph as soon as all of its dependencies have finished.
+    # All bookkeeping is driven by task completion callbacks, so the cost per task is
+    # proportional to its number of dependencies rather than to the size of the graph.
+    # Ready tasks start, and queue for rate limited api handlers, in priority order: first
+    # by the user-supplied Task.priority, then by the length of the longest chain of tasks
+    # waiting on them, so that work on the critical path is not stuck behind side work.
+    # With release_outputs, a task's output is released as soon as every task reading it
+    # has finished, so that memory use follows the running part of the graph rather than
+    # everything it ever ran. The graph's output task keeps its output.
+    def __init__(
+        self,
+        graph: "TaskGraph",
+        function_registry: FunctionRegistry,
+        release_outputs: Optional[ReleasePolicy] = None,
+    ):
+        self.graph = graph
+        self.function_registry = function_registry
+        self.release_outputs = release_outputs
+
+        # Tasks that are waiting on dependencies, with the number of unfinished dependencies.
+        self.waiting_on: dict[Task, int] = {}
+        # For each unfinished task, the waiting tasks to notify when it finishes.
+        self.dependents: defaultdict[Task, list[Task]] = defaultdict(list)
+        self.finished: set[Task] = set()
+        # Heap of (priority, insertion order, task) for tasks ready to start.
+        self.ready: list[tuple[tuple[float, ...], int, Task]] = []
+        self.running: set[Task] = set()
+        # For each unstarted task, the number of tasks in the longest chain from it
+        # through tasks waiting on it, itself included.
+        self.depth: dict[Task, int] = {}
+        self.order = itertools.count()
+        # Priorities of tasks in a subgraph follow the priority of its TaskGraphTask.
+        self.base_priority: tuple[float, ...] = ()
+        # With release_outputs, the number of unfinished tasks reading each task's output,
+        # and the tasks whose outputs were released.
+        self.readers: defaultdict[Task, int] = defaultdict(int)
+        self.released: set[Task] = set()
+
+        # Resolved when every task has finished, or with the first failed task.
+        self.outcome: Optional[asyncio.Future[Optional[Task]]] = None
+
+    def add(self, tasks: list[Task]) -> None:
+        # Adds tasks to a running graph, each after its dependencies.
+        for task in tasks:
+            self.track(task, wait_for_creator=False)
+            self.depth[task] = 1
+            for dep in task.dependencies:
+                if dep in self.waiting_on:
+                    self.raise_depth(dep, 2)
+        for task in tasks:
+            if task not in self.waiting_on:
+                self.push_ready(task)
+        self.start_ready()
+
+    def track(self, task: Task, wait_for_creator: bool = True) -> None:
+        # Clear any state left over from a previous run.
+        task.output = None
+        task.stats.reset_timing()
+
+        inputs = task.deps + tuple(task.kwdeps.values())
+        if self.release_outputs is not None:
+            for dep in inputs:
+                self.readers[dep] += 1
+
+        # Tasks created in an earlier run wait for their creator, which may run again and
+        # replace them. Tasks created during this run don't: their creator is running,
+        # and they may start before it finishes, e.g. while its response streams in.
+        deps = task.dependencies if wait_for_creator else inputs
+        unfinished = [dep for dep in deps if dep not in self.finished]
+        if unfinished:
+            self.waiting_on[task] = len(unfinished)
+            for dep in unfinished:
+                self.dependents[dep].append(task)
+        else:
+            task.stats.ready_at = task.stats.queued_at
+
+    def remove(self, tasks: set[Task]) -> None:
+        # The removed tasks are all waiting, on the running task that created them or on
+        # each other.
+        for task in tasks:
+            del self.waiting_on[task]
+            self.depth.pop(task, None)
+            self.dependents.pop(task, None)
+        if self.release_outputs is not None:
+            for task in tasks:
+                self.readers.pop(task, None)
+                self.finish_reading(task)
+
+    def check_readable(self, task: Task) -> None:
+        # Raises if a task being added would read an output that was dropped.
+        if self.release_outputs == "drop":
+            for dep in task.deps + tuple(task.kwdeps.values()):
+                if dep in self.released:
+                    raise ValueError(f"Output of task {dep.task_id} was released")
+
+    def finish_reading(self, task: Task) -> None:
+        # `task` won't read its dependencies again; release those with no readers left.
+        for dep in task.deps + tuple(task.kwdeps.values()):
+            if dep in self.readers:
+                self.readers[dep] -= 1
+                if self.readers[dep] == 0:
+                    del self.readers[dep]
+                    if dep in self.finished:
+                        self.release(dep)
+
+    def release(self, task: Task) -> None:
+        # Frees the task's payloads. Spilled payloads are read back on access; since the
+        # output future is dropped, dependents added later read output_data instead.
+        if task is self.graph.output_task:
+            return
+        task.output = None
+        store = self.release_outputs
+        for name in task.payload_attributes:
+            value = task.loaded_value(name)
+            if value is None:
+                # Nothing to free, or already spilled and not read since.
+                continue
+            if isinstance(store, BlobStore):
+                key = f"{task.task_id}/{name}"
+                if task in self.released and key in store:
+                    # Read back since it was spilled; it hasn't changed.
+                    task.load_lazily(name, partial(store.get, key))
+                elif store.put(key, value):
+                    task.load_lazily(name, partial(store.get, key))
+            else:
+                setattr(task, name, None)
+        self.released.add(task)
+        if isinstance(task, TaskGraphTask) and task.subgraph.output_task is not None:
+            # Its subgraph has finished, and its output is this task's.
+            self.release(task.subgraph.output_task)
+        if isinstance(task, MapTask):
+            # Its elements' outputs make up its own, and their prompts and responses are
+            # as large.
+            for child in task.children:
+                self.release(child)
+
+    def raise_depth(self, task: Task, depth: int) -> None:
+        # A task was added downstream of a waiting task; lengthen the chains through it.
+        # Tasks that already started keep the priority they started with.
+        stack = [(task, depth)]
+        while stack:
+            task, depth = stack.pop()
+            if depth <= self.depth[task]:
+                continue
+            self.depth[task] = depth
+            for dep in task.dependencies:
+                if dep in self.waiting_on:
+                    stack.append((dep, depth + 1))
+
+    def push_ready(self, task: Task) -> None:
+        priority = (-task.priority, -self.depth.pop(task))
+        heapq.heappush(self.ready, (priority, next(self.order), task))
+
+    def start_ready(self) -> None:
+        while self.ready:
+            priority, _, task = heapq.heappop(self.ready)
+            task.stats.started_at = time.time()
+            # The new asyncio task copies the current context, including its priority.
+            token = request_priority.set(self.base_priority + priority)
+            try:
+                task.output = asyncio.create_task(
+                    task.run(self.graph, self.function_registry)
+                )
+            finally:
+                request_priority.reset(token)
+            task.output.add_done_callback(partial(self.on_done, task))
+            self.running.add(task)
+            self.graph.emit(TaskEvent(TASK_STARTED, task))
+
+    def on_done(self, task: Task, output: asyncio.Future[object]) -> None:
+        self.running.discard(task)
+        task.stats.completed_at = time.time()
+        # Checked before anything else so asyncio doesn't log the exception as unretrieved.
+        failed = output.cancelled() or output.exception() is not None
+        if not output.cancelled():
+            self.graph.emit(TaskEvent(TASK_FAILED if failed else TASK_COMPLETED, task))
+        assert self.outcome is not None
+        if self.outcome.done():
+            return
+
+        if failed:
+            self.outcome.set_result(task)
+            return
+
+        self.finished.add(task)
+        if self.release_outputs is not None:
+            self.finish_reading(task)
+            if task not in self.readers:
+                self.release(task)
+        for dependent in self.dependents.pop(task, ()):
+            if dependent not in self.waiting_on:
+                # Removed from the graph while waiting.
+                continue
+            self.waiting_on[dependent] -= 1
+            if self.waiting_on[dependent] == 0:
+                del self.waiting_on[dependent]
+                dependent.stats.ready_at = time.time()
+                self.push_ready(dependent)
+        self.start_ready()
+
+        if not self.running:
+            self.outcome.set_result(None)
+
+    def cancel_all(self) -> None:
+        for task in self.running:
+            assert task.output is not None
+            task.output.cancel()
+
+    async def run(self) -> None:
+        self.outcome = asyncio.get_running_loop().create_future()
+        self.base_priority = request_priority.get()
+        tasks = self.graph.tasks
+        for task in tasks:
+            self.track(task)
+        # Tasks are stored after their dependencies, so one pass in reverse order finds
+        # the depth of every task.
+        for task in reversed(tasks):
+            self.depth[task] = 1 + max(
+                (self.depth[dependent] for dependent in self.dependents.get(task, ())),
+                default=0,
+            )
+        for task in tasks:
+            if task not in self.waiting_on:
+                self.push_ready(task)
+        # N.B.: Tasks added during execution will be started by TaskGraph.add_task.
+        self.start_ready()
+        if not self.running:
+            self.outcome.set_result(None)
+
+        try:
+            failed_task = await self.outcome
+        except asyncio.CancelledError:
+            self.cancel_all()
+            raise
+
+        if failed_task is not None:
+            self.cancel_all()
+            assert failed_task.output is not None
+            if failed_task.output.cancelled():
+                raise Exception("Subtask failed.") from asyncio.CancelledError()
+            raise Exception("Subtask failed.") from failed_task.output.exception()
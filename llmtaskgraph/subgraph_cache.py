@@ -0,0 +1,97 @@
+import asyncio
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Optional
+
+from llmtaskgraph.types import JSON, JSONValue
+
+from .task import fingerprint
+
+if TYPE_CHECKING:
+    from .task_graph import TaskGraph
+
+# Task JSON that differs between copies of the same graph.
+_VOLATILE_KEYS = ("task_id", "stats", "error")
+
+
+def _graph_structure(graph_json: Any) -> JSONValue:
+    # A graph's JSON with task ids replaced by indexes, and without what differs between
+    # copies. The graph input is left out; it is keyed separately.
+    indexes = {
+        task_json["task_id"]: index
+        for index, task_json in enumerate(graph_json["tasks"])
+    }
+    output_task = graph_json["output_task"]
+    return [
+        [_task_structure(task_json, indexes) for task_json in graph_json["tasks"]],
+        indexes[output_task] if output_task is not None else None,
+    ]
+
+
+def _task_structure(task_json: Any, indexes: dict[str, int]) -> JSON:
+    structure: JSON = {}
+    for key, value in task_json.items():
+        if key in _VOLATILE_KEYS:
+            continue
+        if key == "deps":
+            value = [indexes[dep] for dep in value]
+        elif key == "kwdeps":
+            value = {name: indexes[dep] for name, dep in value.items()}
+        elif key == "created_by" and value is not None:
+            value = indexes[value]
+        elif key == "subgraph":
+            value = _graph_structure(value)
+        elif key == "template":
+            value = _task_structure(value, {})
+        elif key == "items":
+            value = [_task_structure(item, {}) for item in value]
+        structure[key] = value
+    return structure
+
+
+class SubgraphCache:
+    # Opt-in cache of the subgraphs run by TaskGraphTasks, keyed by a fingerprint of the
+    # subgraph's tasks and their state, and of its graph input. A TaskGraphTask whose
+    # subgraph and input match an entry doesn't run it: it outputs the cached result, and
+    # its subgraph is replaced by a copy of the finished one. Identical subgraphs that are
+    # already running are waited for rather than run again. Keeps the max_entries most
+    # recently used subgraphs in memory.
+    # N.B.: identical sampling subgraphs all receive the same result.
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, "TaskGraph"] = OrderedDict()
+        # Resolved when the subgraph being run for a key finishes.
+        self.running: dict[str, asyncio.Future[None]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, subgraph: "TaskGraph", graph_input: JSONValue) -> Optional[str]:
+        # None if the subgraph or its input aren't JSON; such subgraphs aren't cached.
+        return fingerprint(_graph_structure(subgraph.to_json()), graph_input)
+
+    async def get(self, key: str) -> Optional["TaskGraph"]:
+        # On a miss, the caller is expected to run the subgraph, and to pass it to put, or
+        # call abandon if it fails.
+        while key in self.running:
+            await asyncio.wait([self.running[key]])
+        subgraph = self.entries.get(key)
+        if subgraph is None:
+            self.misses += 1
+            self.running[key] = asyncio.get_running_loop().create_future()
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return subgraph.clone()
+
+    def put(self, key: str, subgraph: "TaskGraph") -> None:
+        # Stores a copy, so later runs of `subgraph` don't change the entry.
+        self.entries[key] = subgraph.clone()
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.abandon(key)
+
+    def abandon(self, key: str) -> None:
+        # Lets the next task waiting for this key run its subgraph.
+        running = self.running.pop(key, None)
+        if running is not None and not running.done():
+            running.set_result(None)
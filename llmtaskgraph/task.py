@@ -1,14 +1,21 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
+import asyncio
 from asyncio import Future
+import copy
+import hashlib
 import inspect
+import itertools
+import json as jsonlib
+import os
+import secrets
 import traceback
-from typing import Optional
-from uuid import uuid4
+from typing import Any, AsyncIterator, Callable, Optional
 
 from typing import TYPE_CHECKING
 
 from llmtaskgraph.function_registry import FunctionId, FunctionRegistry
+from llmtaskgraph.instrumentation import TaskStats, current_task_stats
 from llmtaskgraph.types import (
     JSON,
     JSONValue,
@@ -21,14 +28,130 @@ if TYPE_CHECKING:
     from .task_graph import TaskGraph
 
 
+def fingerprint(*values: JSONValue) -> Optional[str]:
+    # None if the values aren't all JSON, e.g. a set returned by a PythonTask. Whatever
+    # is computed from them is then recomputed every run.
+    try:
+        encoded = jsonlib.dumps(values, sort_keys=True, separators=(",", ":"))
+    except (TypeError, ValueError):
+        return None
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+# Recorded in place of a fingerprint that couldn't be computed. Unlike None, which is left
+# by traces that predate fingerprints, it matches no fingerprint.
+UNFINGERPRINTED = ""
+
+
+# Task ids are a random prefix, chosen once per process, and a counter. They are as
+# unlikely to collide as uuids, but shorter and much cheaper to make.
+_task_id_prefix = secrets.token_hex(8)
+_task_id_counter = itertools.count()
+
+
+def _reset_task_ids() -> None:
+    global _task_id_prefix, _task_id_counter
+    _task_id_prefix = secrets.token_hex(8)
+    _task_id_counter = itertools.count()
+
+
+os.register_at_fork(after_in_child=_reset_task_ids)
+
+
+def new_task_id() -> str:
+    return f"{_task_id_prefix}-{next(_task_id_counter):x}"
+
+
+# Shared by every task without kwdeps, to save a dict per task. Never modified.
+_NO_KWDEPS: dict[str, Task] = {}
+
+
 class Task(ABC):
+    # Large graphs hold many tasks, so tasks and their stats use __slots__ rather than a
+    # __dict__ per instance. Subclasses declare their own attributes.
+    __slots__ = (
+        "task_id",
+        "deps",
+        "kwdeps",
+        "created_by",
+        "created_in",
+        "output_data",
+        "output",
+        "fingerprint",
+        "stats",
+        "priority",
+        "_lazy_attributes",
+    )
+    # Attributes that may hold large values, which runs that release outputs spill or drop
+    # once no task will read this task's output.
+    payload_attributes: tuple[str, ...] = ("output_data",)
+
     def __init__(self, *deps: Task, **kwdeps: Task):
-        self.task_id: str = str(uuid4())
+        self.task_id: str = new_task_id()
         self.deps: tuple[Task, ...] = deps
-        self.kwdeps: dict[str, Task] = kwdeps
+        self.kwdeps: dict[str, Task] = kwdeps if kwdeps else _NO_KWDEPS
         self.created_by: Optional[Task] = None
+        # The stage of created_by's execution that created this task; see GraphContext.
+        self.created_in: Optional[str] = None
         self.output_data: Optional[JSONValue] = None
         self.output: Optional[Future[JSONValue]] = None
+        # Fingerprint of the inputs output_data was computed from. None for tasks loaded
+        # from traces saved without one, whose output is trusted as is.
+        self.fingerprint: Optional[str] = None
+        self.stats = TaskStats()
+        # Higher priority tasks start, and get rate limited api calls, first.
+        self.priority: float = 0
+        self._lazy_attributes: Optional[dict[str, Callable[[], Any]]] = None
+
+    def load_lazily(self, name: str, load: Callable[[], Any]) -> None:
+        # Replaces attribute `name` with a call to `load` on its first access. Used to
+        # open large traces without loading payloads that are never read.
+        try:
+            delattr(self, name)
+        except AttributeError:
+            pass
+        if self._lazy_attributes is None:
+            self._lazy_attributes = {}
+        self._lazy_attributes[name] = load
+
+    def loaded_value(self, name: str) -> Any:
+        # The value of attribute `name` if it is in memory, without loading it.
+        try:
+            return object.__getattribute__(self, name)
+        except AttributeError:
+            return None
+
+    if not TYPE_CHECKING:
+
+        def __getattr__(self, name: str) -> Any:
+            # Only called for attributes that aren't set, like those loaded lazily.
+            if name != "_lazy_attributes" and name in (self._lazy_attributes or ()):
+                value = self._lazy_attributes.pop(name)()
+                setattr(self, name, value)
+                return value
+            raise AttributeError(
+                f"{type(self).__name__!r} object has no attribute {name!r}"
+            )
+
+    def __copy__(self) -> Task:
+        # copy.copy would read every slot with getattr, loading any lazy attributes.
+        # Copies them unloaded instead; each copy loads its own.
+        task = object.__new__(type(self))
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get("__slots__", ()):
+                if name in ("__dict__", "__weakref__"):
+                    continue
+                try:
+                    value = object.__getattribute__(self, name)
+                except AttributeError:
+                    continue
+                object.__setattr__(task, name, value)
+        # Subclasses that don't declare __slots__ keep their other attributes in one.
+        if hasattr(self, "__dict__"):
+            task.__dict__.update(self.__dict__)
+        if self._lazy_attributes:
+            task._lazy_attributes = dict(self._lazy_attributes)
+        return task
 
     @property
     def dependencies(self) -> tuple[Task, ...]:
@@ -38,30 +161,103 @@ class Task(ABC):
         else:
             return declared_deps
 
+    def clone(self, clones: dict[Task, Task]) -> Task:
+        # A copy of this task and its state, for another instance of its graph. Its
+        # dependencies are replaced by their clones; configuration and output are shared,
+        # since they are never modified in place.
+        task = copy.copy(self)
+        task.deps = tuple(clones[dep] for dep in self.deps)
+        if self.kwdeps:
+            task.kwdeps = {name: clones[kwdep] for name, kwdep in self.kwdeps.items()}
+        task.created_by = clones[self.created_by] if self.created_by else None
+        task.output = None
+        task.stats = TaskStats()
+        return task
+
     async def run(
         self, graph: TaskGraph, function_registry: FunctionRegistry
     ) -> JSONValue:
-        # Memoize output.
-        if self.output_data is not None:
-            return self.output_data
-
         # Collect dependency output. We know tasks are actual Tasks with output futures at this point.
         try:
-            dep_results: list[JSONValue] = [await dep.output for dep in self.deps]  # type: ignore
+            dep_results: list[JSONValue] = [await dep.result() for dep in self.deps]
             kwdep_results: dict[str, JSONValue] = {
-                kwdep_name: await kwdep.output for kwdep_name, kwdep in self.kwdeps.items()  # type: ignore
+                kwdep_name: await kwdep.result()
+                for kwdep_name, kwdep in self.kwdeps.items()
             }
         except Exception:
             # If any dependency failed, silently abort. The exception will be handled by the TaskGraph.
             return None
 
-        # Execute task.
-        context: GraphContext = graph.make_context_for(self)
+        return await self.run_with_inputs(
+            graph.make_context_for(self), function_registry, dep_results, kwdep_results
+        )
+
+    async def result(self) -> JSONValue:
+        # The output of a task that has run. Once released, it is only kept in output_data.
+        if self.output is None:
+            return self.output_data
+        return await self.output
+
+    async def run_with_inputs(
+        self,
+        context: GraphContext,
+        function_registry: FunctionRegistry,
+        dep_results: list[JSONValue],
+        kwdep_results: dict[str, JSONValue],
+    ) -> JSONValue:
+        # Memoize output, as long as nothing it was computed from has changed.
+        input_fingerprint = self.compute_fingerprint(
+            context, dep_results, kwdep_results
+        )
+        if input_fingerprint is not None and self.output_is_current(input_fingerprint):
+            self.fingerprint = input_fingerprint
+            return self.output_data
+
+        # Tasks created by a previous execution are stale; this execution recreates them.
+        # Those created by stages of execute that are skipped because their inputs are
+        # unchanged, like an LLMTask's prompt formatter, are kept.
+        context.remove_created_tasks()
+
+        # Execute task. Api handlers report usage to the stats of the running task.
+        current_task_stats.set(self.stats)
         self.output_data = await self.execute(
             context, function_registry, *dep_results, **kwdep_results
         )
+        # Intermediate state, like an LLMTask's response, is only final after executing.
+        self.fingerprint = (
+            self.compute_fingerprint(context, dep_results, kwdep_results)
+            or UNFINGERPRINTED
+        )
         return self.output_data
 
+    def compute_fingerprint(
+        self,
+        context: GraphContext,
+        dep_results: list[JSONValue],
+        kwdep_results: dict[str, JSONValue],
+    ) -> Optional[str]:
+        # Covers everything the output depends on: the task's own configuration, its
+        # dependencies' output and the graph's input, which any task may read.
+        if context.graph.input_fingerprint is None:
+            return None
+        return fingerprint(
+            self.__class__.__name__,
+            self.fingerprint_config(),
+            context.graph.input_fingerprint,
+            dep_results,
+            kwdep_results,
+        )
+
+    def output_is_current(self, input_fingerprint: str) -> bool:
+        return self.output_data is not None and self.fingerprint in (
+            input_fingerprint,
+            None,
+        )
+
+    @abstractmethod
+    def fingerprint_config(self) -> JSONValue:
+        pass
+
     @abstractmethod
     async def execute(
         self,
@@ -78,7 +274,7 @@ class Task(ABC):
             return dep.task_id
 
         def get_exception_str(future: Optional[Future[JSONValue]]) -> Optional[str]:
-            if future is None or not future.done():
+            if future is None or not future.done() or future.cancelled():
                 return None
             e = future.exception()
             if e is None:
@@ -91,9 +287,13 @@ class Task(ABC):
             "deps": [get_id(dep) for dep in self.deps],
             "kwdeps": {k: get_id(v) for k, v in self.kwdeps.items()},
             "created_by": get_id(self.created_by) if self.created_by else None,
+            "created_in": self.created_in,
             # TODO may need to do something fancier at some point to handle custom types in output_data
             "output_data": self.output_data,
             "error": get_exception_str(self.output),
+            "fingerprint": self.fingerprint,
+            "stats": self.stats.to_json(),
+            "priority": self.priority,
         }
 
     @classmethod
@@ -106,21 +306,47 @@ class Task(ABC):
         assert isinstance(task_id, str)
         self.task_id = task_id
         self.deps = tuple(tasks[dep_id] for dep_id in json["deps"])  # type: ignore
-        self.kwdeps = {
-            kwdep_name: tasks[kwdep_id]
-            for kwdep_name, kwdep_id in json["kwdeps"].items()  # type: ignore
-        }
+        if json["kwdeps"]:
+            self.kwdeps = {
+                kwdep_name: tasks[kwdep_id]
+                for kwdep_name, kwdep_id in json["kwdeps"].items()  # type: ignore
+            }
         if json["created_by"]:
             created_by = json["created_by"]
             assert isinstance(created_by, str)
             self.created_by = tasks[created_by]
         else:
             self.created_by = None
+        created_in = json.get("created_in")
+        assert isinstance(created_in, str | None)
+        self.created_in = created_in
         # TODO may need to do something fancier at some point to handle custom types in output_data
         self.output_data = json["output_data"]
+        fingerprint = json.get("fingerprint")
+        assert isinstance(fingerprint, str | None)
+        self.fingerprint = fingerprint
+        self.stats = TaskStats.from_json(json.get("stats"))
+        priority = json.get("priority", 0)
+        assert isinstance(priority, (int, float))
+        self.priority = priority
 
 
 class LLMTask(Task):
+    __slots__ = (
+        "prompt_formatter_id",
+        "api_handler_id",
+        "params",
+        "output_parser_id",
+        "incremental_parser_id",
+        "formatted_prompt",
+        "response",
+        "prompt_fingerprint",
+        "request_fingerprint",
+        "partial_response",
+        "partial_output",
+    )
+    payload_attributes = ("output_data", "formatted_prompt", "response")
+
     def __init__(
         self,
         prompt_formatter_id: FunctionId[..., Prompt],
@@ -128,6 +354,7 @@ class LLMTask(Task):
         params: JSON,
         output_parser_id: FunctionId[[str], JSONValue],
         *deps: Task,
+        incremental_parser_id: Optional[FunctionId[[str], JSONValue]] = None,
         **kwdeps: Task,
     ):
         super().__init__(*deps, **kwdeps)
@@ -135,8 +362,19 @@ class LLMTask(Task):
         self.api_handler_id = api_handler_id
         self.params = params
         self.output_parser_id = output_parser_id
+        # If set, and the api handler can stream, the response is streamed and this parser
+        # is called with the response so far after each chunk. Its result is available as
+        # partial_output, and it may add tasks for items that are already complete. A
+        # response that isn't streamed is passed to it once, whole.
+        self.incremental_parser_id = incremental_parser_id
         self.formatted_prompt: Prompt | None = None
         self.response: str | None = None
+        # Fingerprints of the inputs formatted_prompt and response were computed from.
+        self.prompt_fingerprint: Optional[str] = None
+        self.request_fingerprint: Optional[str] = None
+        # transient state while a response is streamed
+        self.partial_response: str | None = None
+        self.partial_output: JSONValue = None
 
     async def execute(
         self,
@@ -145,16 +383,105 @@ class LLMTask(Task):
         *dep_results: JSONValue,
         **kwdep_results: JSONValue,
     ) -> JSONValue:
-        if self.formatted_prompt is None:
+        # Keep the prompt and response from a previous run unless their inputs changed, so
+        # that edits to them are respected.
+        prompt_fingerprint = context.graph.input_fingerprint and fingerprint(
+            self.prompt_formatter_id.to_json(),
+            context.graph.input_fingerprint,
+            list(dep_results),
+            kwdep_results,
+        )
+        if (
+            self.formatted_prompt is None
+            or prompt_fingerprint is None
+            or self.prompt_fingerprint not in (prompt_fingerprint, None)
+        ):
+            prompt_context = context.in_stage("prompt")
+            prompt_context.remove_created_tasks()
             self.formatted_prompt = function_registry[self.prompt_formatter_id](
-                context, *dep_results, **kwdep_results
+                prompt_context, *dep_results, **kwdep_results
+            )
+        self.prompt_fingerprint = prompt_fingerprint or UNFINGERPRINTED
+        request_fingerprint = fingerprint(
+            self.api_handler_id.to_json(),
+            self.params,
+            PromptToJSONValue(self.formatted_prompt),
+        )
+        if request_fingerprint is None or self.request_fingerprint not in (
+            request_fingerprint,
+            None,
+        ):
+            self.response = None
+        self.request_fingerprint = request_fingerprint or UNFINGERPRINTED
+
+        response_cache = context.graph.response_cache
+        occurrence = 0
+        if self.response is None and response_cache is not None:
+            assert context.graph.request_occurrences is not None
+            occurrence = context.graph.request_occurrences.next(
+                self.api_handler_id, self.formatted_prompt, self.params
+            )
+            self.response = response_cache.get(
+                self.api_handler_id, self.formatted_prompt, self.params, occurrence
             )
+        streamed = False
         if self.response is None:
-            self.response = await function_registry.get_api_handler(
-                self.api_handler_id
-            )(self.formatted_prompt, self.params)
+            stream = function_registry.get_stream(self.api_handler_id)
+            if self.incremental_parser_id and stream:
+                self.response = await self.stream_response(
+                    context, function_registry, stream
+                )
+                streamed = True
+            else:
+                assert context.graph.coalescer is not None
+                self.response = await context.graph.coalescer.api_call(
+                    self.api_handler_id, self.formatted_prompt, self.params
+                )
+            if response_cache is not None:
+                response_cache.put(
+                    self.api_handler_id,
+                    self.formatted_prompt,
+                    self.params,
+                    self.response,
+                    occurrence,
+                )
+        if self.incremental_parser_id and not streamed:
+            # A response that wasn't streamed, e.g. from the cache or edited, is parsed
+            # incrementally in one go, so that the tasks the parser adds don't depend on
+            # where the response came from.
+            function_registry[self.incremental_parser_id](context, self.response)
         return function_registry[self.output_parser_id](context, self.response)
 
+    async def stream_response(
+        self,
+        context: GraphContext,
+        function_registry: FunctionRegistry,
+        stream: Callable[[Prompt, JSON], AsyncIterator[str]],
+    ) -> str:
+        assert self.formatted_prompt is not None
+        assert self.incremental_parser_id is not None
+        incremental_parser = function_registry[self.incremental_parser_id]
+        chunks: list[str] = []
+        async for chunk in stream(self.formatted_prompt, self.params):
+            chunks.append(chunk)
+            self.partial_response = "".join(chunks)
+            self.partial_output = incremental_parser(context, self.partial_response)
+            context.report_progress()
+
+        self.partial_response = None
+        self.partial_output = None
+        return "".join(chunks)
+
+    def fingerprint_config(self) -> JSONValue:
+        return [
+            self.prompt_formatter_id.to_json(),
+            self.api_handler_id.to_json(),
+            self.params,
+            self.output_parser_id.to_json(),
+            PromptToJSONValue(self.formatted_prompt),
+            self.response,
+        ]
+
     def to_json(self) -> JSON:
         json = super().to_json()
         json.update(
@@ -163,10 +490,20 @@ class LLMTask(Task):
                 "api_handler_id": self.api_handler_id.to_json(),
                 "params": self.params,
                 "output_parser_id": self.output_parser_id.to_json(),
+                "incremental_parser_id": (
+                    self.incremental_parser_id.to_json()
+                    if self.incremental_parser_id
+                    else None
+                ),
                 "formatted_prompt": PromptToJSONValue(self.formatted_prompt),
                 "response": self.response,
+                "prompt_fingerprint": self.prompt_fingerprint,
+                "request_fingerprint": self.request_fingerprint,
             }
         )
+        if self.partial_response is not None:
+            json["partial_response"] = self.partial_response
+            json["partial_output"] = self.partial_output
         return json
 
     @classmethod
@@ -179,6 +516,9 @@ class LLMTask(Task):
             params,
             FunctionId.from_json(json.pop("output_parser_id")),
         )
+        incremental_parser_id = json.pop("incremental_parser_id", None)
+        if incremental_parser_id:
+            task.incremental_parser_id = FunctionId.from_json(incremental_parser_id)
         task.init_from_json(json, tasks)
         formatted_prompt = json.pop("formatted_prompt")
         assert isinstance(formatted_prompt, str | None)
@@ -186,10 +526,18 @@ class LLMTask(Task):
         response = json.pop("response")
         assert isinstance(response, str | None)
         task.response = response
+        prompt_fingerprint = json.pop("prompt_fingerprint", None)
+        assert isinstance(prompt_fingerprint, str | None)
+        task.prompt_fingerprint = prompt_fingerprint
+        request_fingerprint = json.pop("request_fingerprint", None)
+        assert isinstance(request_fingerprint, str | None)
+        task.request_fingerprint = request_fingerprint
         return task
 
 
 class PythonTask(Task):
+    __slots__ = ("callback_id",)
+
     def __init__(
         self, callback_id: FunctionId[..., JSONValue], *deps: Task, **kwdeps: Task
     ):
@@ -206,8 +554,24 @@ class PythonTask(Task):
         callback = function_registry[self.callback_id]
         if inspect.iscoroutinefunction(callback):
             return await callback(context, *dep_results, **kwdep_results)
-        else:
+
+        execution_policy = function_registry.get_execution_policy(self.callback_id)
+        if execution_policy == "inline":
             return callback(context, *dep_results, **kwdep_results)
+        executors = context.graph.executors
+        assert executors is not None
+        if execution_policy == "thread":
+            return await executors.run_in_thread(
+                callback, context, *dep_results, **kwdep_results
+            )
+        return await executors.run_in_process(
+            function_registry.get_process_callable(self.callback_id),
+            *dep_results,
+            **kwdep_results,
+        )
+
+    def fingerprint_config(self) -> JSONValue:
+        return self.callback_id.to_json()
 
     def to_json(self) -> JSON:
         json = super().to_json()
@@ -228,6 +592,13 @@ class PythonTask(Task):
 
 
 class TaskGraphTask(Task):
+    __slots__ = (
+        "subgraph",
+        "input_formatter_id",
+        "graph_input",
+        "graph_input_fingerprint",
+    )
+
     def __init__(
         self,
         subgraph: "TaskGraph",
@@ -239,6 +610,8 @@ class TaskGraphTask(Task):
         self.subgraph = subgraph
         self.input_formatter_id = input_formatter_id
         self.graph_input = None
+        # Fingerprint of the inputs graph_input was computed from.
+        self.graph_input_fingerprint: Optional[str] = None
 
     async def execute(
         self,
@@ -247,23 +620,52 @@ class TaskGraphTask(Task):
         *dep_results: JSONValue,
         **kwdep_results: JSONValue,
     ) -> JSONValue:
-        if self.graph_input is None:
+        graph_input_fingerprint = context.graph.input_fingerprint and fingerprint(
+            self.input_formatter_id.to_json(),
+            context.graph.input_fingerprint,
+            list(dep_results),
+            kwdep_results,
+        )
+        if (
+            self.graph_input is None
+            or graph_input_fingerprint is None
+            or self.graph_input_fingerprint not in (graph_input_fingerprint, None)
+        ):
+            input_context = context.in_stage("input")
+            input_context.remove_created_tasks()
             self.graph_input = function_registry[self.input_formatter_id](
-                context, *dep_results, **kwdep_results
+                input_context, *dep_results, **kwdep_results
             )
+        self.graph_input_fingerprint = graph_input_fingerprint or UNFINGERPRINTED
 
         self.subgraph.graph_input = self.graph_input
-        return await self.subgraph.run(function_registry)
+        return await context.graph.run_subgraph(self)
 
-    def to_json(self) -> JSON:
+    def clone(self, clones: dict[Task, Task]) -> Task:
+        task = super().clone(clones)
+        assert isinstance(task, TaskGraphTask)
+        task.subgraph = self.subgraph.clone()
+        return task
+
+    def output_is_current(self, input_fingerprint: str) -> bool:
+        # Tasks in the subgraph may have changed independently. Running it again only
+        # recomputes what changed.
+        return False
+
+    def fingerprint_config(self) -> JSONValue:
+        return [self.input_formatter_id.to_json(), self.graph_input]
+
+    def to_json(self, include_subgraph: bool = True) -> JSON:
         json = super().to_json()
         json.update(
             {
-                "subgraph": self.subgraph.to_json(),
                 "input_formatter_id": self.input_formatter_id.to_json(),
                 "graph_input": self.graph_input,
+                "graph_input_fingerprint": self.graph_input_fingerprint,
             }
         )
+        if include_subgraph:
+            json["subgraph"] = self.subgraph.to_json()
         return json
 
     @classmethod
@@ -280,6 +682,125 @@ class TaskGraphTask(Task):
         )
         task.init_from_json(json, tasks)
         task.graph_input = json.pop("graph_input")
+        graph_input_fingerprint = json.pop("graph_input_fingerprint", None)
+        assert isinstance(graph_input_fingerprint, str | None)
+        task.graph_input_fingerprint = graph_input_fingerprint
+        return task
+
+
+class MapTask(Task):
+    # Applies a template task to every element of a dependency's list output, and outputs
+    # the list of results in order. The template's callbacks receive the element in place
+    # of their first dependency result, followed by the results of the MapTask's other
+    # dependencies. Each element is run as a copy of the template that is kept inside the
+    # MapTask rather than added to the graph, and is memoized on its own; the MapTask is
+    # serialized as the template plus the state that differs for each element.
+    # N.B.: Template callbacks run with the MapTask's GraphContext, so tasks they add are
+    # created by the MapTask, in a stage named after the element's index.
+    __slots__ = ("template", "children")
+
+    def __init__(self, template: Task, items: Task, *deps: Task, **kwdeps: Task):
+        super().__init__(items, *deps, **kwdeps)
+        assert not template.dependencies, "Template tasks can't have dependencies"
+        self.template = template
+        self.children: list[Task] = []
+
+    async def execute(
+        self,
+        context: GraphContext,
+        function_registry: FunctionRegistry,
+        *dep_results: JSONValue,
+        **kwdep_results: JSONValue,
+    ) -> JSONValue:
+        items, *other_results = dep_results
+        assert isinstance(items, list), "MapTask items must be a list"
+        for index in range(len(items), len(self.children)):
+            context.in_stage(str(index)).remove_created_tasks(nested=True)
+        del self.children[len(items) :]
+        if len(self.children) < len(items):
+            template_json = self.template.to_json()
+            self.children.extend(
+                self.make_child(template_json, str(index))
+                for index in range(len(self.children), len(items))
+            )
+
+        for child in self.children:
+            child.stats = TaskStats()
+        results = await asyncio.gather(
+            *(
+                child.run_with_inputs(
+                    context.in_stage(str(index)),
+                    function_registry,
+                    [item, *other_results],
+                    kwdep_results,
+                )
+                for index, (child, item) in enumerate(zip(self.children, items))
+            )
+        )
+        for child in self.children:
+            self.stats.add_share(child.stats)
+        return list(results)
+
+    def clone(self, clones: dict[Task, Task]) -> Task:
+        task = super().clone(clones)
+        assert isinstance(task, MapTask)
+        task.template = self.template.clone({})
+        task.children = [child.clone({}) for child in self.children]
+        return task
+
+    def make_child(self, child_json: JSON, index: str) -> Task:
+        # Loading consumes the json, including that of any subgraph, so each child gets
+        # its own copy.
+        child_json = copy.deepcopy(child_json)
+        child_json["task_id"] = f"{self.task_id}/{index}"
+        return task_from_json(child_json, {})
+
+    def output_is_current(self, input_fingerprint: str) -> bool:
+        # Elements may have changed independently. Running again only recomputes those.
+        return False
+
+    def fingerprint_config(self) -> JSONValue:
+        return self.template.fingerprint_config()
+
+    def to_json(self) -> JSON:
+        json = super().to_json()
+        template_json = self.template.to_json()
+        json.update(
+            {
+                "template": template_json,
+                "items": [
+                    self.compact_child_json(child, template_json)
+                    for child in self.children
+                ],
+            }
+        )
+        return json
+
+    @staticmethod
+    def compact_child_json(child: Task, template_json: JSON) -> JSON:
+        # Only what differs from the template. Per-element stats are rolled up into the
+        # MapTask's.
+        return {
+            key: value
+            for key, value in child.to_json().items()
+            if key not in ("task_id", "stats") and template_json.get(key) != value
+        }
+
+    @classmethod
+    def from_json(cls, json: JSON, tasks: dict[str, Task]) -> MapTask:
+        template_json = json.pop("template")
+        assert isinstance(template_json, dict)
+        items_json = json.pop("items")
+        assert isinstance(items_json, list)
+        task = cls(
+            task_from_json(copy.deepcopy(template_json), {}),
+            tasks[json["deps"][0]],  # type: ignore
+        )
+        task.init_from_json(json, tasks)
+        task.children = [
+            task.make_child({**template_json, **item_json}, str(index))  # type: ignore
+            for index, item_json in enumerate(items_json)
+        ]
         return task
 
 
@@ -289,6 +810,7 @@ def task_from_json(json: JSON, tasks: dict[str, Task]) -> Task:
         "LLMTask": LLMTask,
         "PythonTask": PythonTask,
         "TaskGraphTask": TaskGraphTask,
+        "MapTask": MapTask,
     }
 
     task_type = json.pop("type")
@@ -1,91 +1,396 @@
 import asyncio
-from typing import Optional
+import concurrent.futures
+import threading
+from typing import TYPE_CHECKING, Collection, Iterator, Optional
 
 from llmtaskgraph.types import JSON, JSONValue
 
-from .task import Task, task_from_json
+from .events import (
+    TASK_CREATED,
+    TASK_PROGRESS,
+    TASK_REMOVED,
+    TASK_RESTORED,
+    TaskEvent,
+    TaskListener,
+)
+from .task import Task, TaskGraphTask, fingerprint, task_from_json
+from .blob_store import ReleasePolicy
+from .coalescer import RequestCoalescer
+from .executors import CallbackExecutors
 from .function_registry import FunctionRegistry, make_base_registry
+from .response_cache import RequestOccurrences, ResponseCache
+from .scheduler import Scheduler
+from .subgraph_cache import SubgraphCache
+
+if TYPE_CHECKING:
+    from .journal import Journal
 
 
 class TaskGraph:
     def __init__(self):
-        self.tasks: list[Task] = []
+        # The graph's tasks in the order they were added, each with its position in that
+        # order, so that removing some doesn't rebuild a list of all of them.
+        self._tasks: dict[Task, int] = {}
+        self._next_position = 0
+        # Indexes over the tasks, kept in sync by _append and remove_tasks_created_by.
+        self._tasks_by_id: dict[str, Task] = {}
+        # Reverse edges: the tasks that depend on each task, and the tasks it created.
+        self._dependents: dict[Task, list[Task]] = {}
+        self._created: dict[Task, list[Task]] = {}
         self.graph_input: JSONValue | None = None
         self.output_task: Optional[Task] = None
+        # For subgraphs, the TaskGraphTask that runs this graph and the graph it is in.
+        self.parent_task: Optional[TaskGraphTask] = None
+        self.parent_graph: Optional["TaskGraph"] = None
+        # Notified of every TaskEvent in this graph and the subgraphs it runs.
+        self.listeners: list[TaskListener] = []
 
         # transient state during run
         self.started = False
         self.function_registry: Optional[FunctionRegistry] = None
+        self.input_fingerprint: Optional[str] = None
+        self.scheduler: Optional[Scheduler] = None
+        self.response_cache: Optional[ResponseCache] = None
+        self.request_occurrences: Optional[RequestOccurrences] = None
+        self.release_outputs: Optional[ReleasePolicy] = None
+        self.subgraph_cache: Optional[SubgraphCache] = None
+        self.coalescer: Optional[RequestCoalescer] = None
+        self.executors: Optional[CallbackExecutors] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread: Optional[int] = None
+
+    @property
+    def tasks(self) -> list[Task]:
+        # A copy; add and remove tasks through the graph.
+        return list(self._tasks)
 
     def add_task(self, task: Task) -> str:
-        for dependency in task.dependencies:
-            if dependency not in self.tasks:
-                raise ValueError(f"Dependency {dependency} not found in task graph")
+        return self.add_tasks([task])[0]
+
+    def add_tasks(self, tasks: list[Task]) -> list[str]:
+        # Adds tasks in one operation; each task's dependencies must be in the graph or
+        # earlier in `tasks`.
+        if self.started and threading.get_ident() != self.loop_thread:
+            # Called from a "thread" callback; the graph is only modified on its loop.
+            # Waits for the tasks to be added, so that errors reach the callback.
+            assert self.loop is not None
+            added_ids: concurrent.futures.Future[list[str]] = (
+                concurrent.futures.Future()
+            )
+
+            def add_on_loop() -> None:
+                try:
+                    added_ids.set_result(self.add_tasks(tasks))
+                except BaseException as error:
+                    added_ids.set_exception(error)
+
+            self.loop.call_soon_threadsafe(add_on_loop)
+            return added_ids.result()
 
-        self.tasks.append(task)
+        added: set[Task] = set()
+        for task in tasks:
+            for dependency in task.dependencies:
+                if dependency not in self._tasks and dependency not in added:
+                    raise ValueError(f"Dependency {dependency} not found in task graph")
+            if self.scheduler is not None:
+                self.scheduler.check_readable(task)
+            added.add(task)
+
+        for task in tasks:
+            self._append(task)
+            self.emit(
+                TaskEvent(TASK_CREATED, task, output_task=task is self.output_task)
+            )
         if self.started:
-            assert self.function_registry is not None
-            task.output = asyncio.create_task(task.run(self, self.function_registry))
+            assert self.scheduler is not None
+            self.scheduler.add(tasks)
 
-        return task.task_id
+        return [task.task_id for task in tasks]
+
+    def _append(self, task: Task) -> None:
+        self._tasks[task] = self._next_position
+        self._next_position += 1
+        self._tasks_by_id[task.task_id] = task
+        for dependency in task.dependencies:
+            self._dependents.setdefault(dependency, []).append(task)
+        if task.created_by is not None:
+            self._created.setdefault(task.created_by, []).append(task)
+        if isinstance(task, TaskGraphTask):
+            task.subgraph.parent_task = task
+            task.subgraph.parent_graph = self
+
+    def remove_tasks_created_by(
+        self, creator: Task, stages: Optional[Collection[Optional[str]]] = None
+    ) -> None:
+        # Removes the tasks created by `creator`, or only those created in `stages` of
+        # its execution (see GraphContext.stage), and every task that depends on them.
+        removed = {
+            task
+            for task in self._created.get(creator, ())
+            if stages is None or task.created_in in stages
+        }
+        if not removed:
+            return
+        stack = list(removed)
+        while stack:
+            for dependent in self._dependents.get(stack.pop(), ()):
+                if dependent not in removed:
+                    removed.add(dependent)
+                    stack.append(dependent)
+
+        removed_in_order = sorted(removed, key=self._tasks.__getitem__)
+        for task in removed_in_order:
+            del self._tasks[task]
+            del self._tasks_by_id[task.task_id]
+            self._dependents.pop(task, None)
+            self._created.pop(task, None)
+            for dependency in task.dependencies:
+                if dependency not in removed:
+                    self._dependents[dependency].remove(task)
+            if task.created_by is not None and task.created_by not in removed:
+                siblings = self._created[task.created_by]
+                siblings.remove(task)
+                if not siblings:
+                    del self._created[task.created_by]
+        if self.output_task in removed:
+            self.output_task = None
+        if self.scheduler is not None:
+            self.scheduler.remove(removed)
+        for task in removed_in_order:
+            self.emit(TaskEvent(TASK_REMOVED, task))
+
+    def get_task(self, task_id: str) -> Task:
+        return self._tasks_by_id[task_id]
+
+    def __contains__(self, task: Task) -> bool:
+        return task in self._tasks
+
+    # Trace queries. Besides dependencies and task creation, they follow the edges implied
+    # by subgraphs: every task in a subgraph depends on the input of its TaskGraphTask, and
+    # the TaskGraphTask depends on the subgraph's output task. Queries take a task of this
+    # graph, and run in time proportional to the size of their result.
+
+    def dependents(self, task: Task) -> list[Task]:
+        # Tasks of this graph that depend on `task` directly, including tasks it created.
+        return list(self._dependents.get(task, ()))
+
+    def tasks_created_by(self, task: Task) -> list[Task]:
+        return list(self._created.get(task, ()))
+
+    def ancestors(self, task: Task) -> list[Task]:
+        # Every task whose output `task` depends on, in this graph, its subgraphs and the
+        # graphs enclosing it.
+        assert task in self
+        result: list[Task] = []
+        seen: set[Task] = {task}
+        entered_parents: set[TaskGraph] = set()
+        stack: list[tuple[TaskGraph, Task]] = [(self, task)]
+        while stack:
+            graph, current = stack.pop()
+            upstream = [(graph, dependency) for dependency in current.dependencies]
+            if isinstance(current, TaskGraphTask) and current.subgraph.output_task:
+                upstream.append((current.subgraph, current.subgraph.output_task))
+            if graph.parent_task is not None and graph not in entered_parents:
+                entered_parents.add(graph)
+                assert graph.parent_graph is not None
+                upstream.extend(
+                    (graph.parent_graph, dependency)
+                    for dependency in graph.parent_task.dependencies
+                )
+            for upstream_graph, upstream_task in upstream:
+                if upstream_task not in seen:
+                    seen.add(upstream_task)
+                    result.append(upstream_task)
+                    stack.append((upstream_graph, upstream_task))
+        return result
+
+    def descendants(self, task: Task) -> list[Task]:
+        # Every task whose output depends on `task`'s, in this graph, its subgraphs and the
+        # graphs enclosing it.
+        assert task in self
+        result: list[Task] = []
+        seen: set[Task] = {task}
+        stack: list[tuple[TaskGraph, Task]] = [(self, task)]
+
+        def visit(graph: TaskGraph, downstream_task: Task) -> None:
+            if downstream_task not in seen:
+                seen.add(downstream_task)
+                result.append(downstream_task)
+                stack.append((graph, downstream_task))
+
+        while stack:
+            graph, current = stack.pop()
+            for dependent in graph._dependents.get(current, ()):
+                if dependent in seen:
+                    continue
+                visit(graph, dependent)
+                if isinstance(dependent, TaskGraphTask):
+                    # Its input changes, and with it everything in its subgraph.
+                    for subgraph, subgraph_task in dependent.subgraph.all_tasks():
+                        visit(subgraph, subgraph_task)
+            if current is graph.output_task and graph.parent_task is not None:
+                assert graph.parent_graph is not None
+                visit(graph.parent_graph, graph.parent_task)
+        return result
+
+    def all_tasks(self) -> Iterator[tuple["TaskGraph", Task]]:
+        # Every task of this graph and its subgraphs, with the graph it is in.
+        for task in self._tasks:
+            yield self, task
+            if isinstance(task, TaskGraphTask):
+                yield from task.subgraph.all_tasks()
+
+    def topological_order(self) -> list[Task]:
+        # Every task of this graph and its subgraphs, after everything it depends on.
+        # Subgraph tasks come right before their TaskGraphTask.
+        order: list[Task] = []
+        for task in self._tasks:
+            if isinstance(task, TaskGraphTask):
+                order.extend(task.subgraph.topological_order())
+            order.append(task)
+        return order
+
+    def add_listener(self, listener: TaskListener) -> None:
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener: TaskListener) -> None:
+        self.listeners.remove(listener)
+
+    def emit(self, event: TaskEvent) -> None:
+        for listener in self.listeners:
+            listener(event)
 
     def add_output_task(self, task: Task):
-        self.add_task(task)
+        # Set first, so that the task's TASK_CREATED event records it.
+        previous_output_task = self.output_task
         self.output_task = task
+        try:
+            self.add_task(task)
+        except BaseException:
+            self.output_task = previous_output_task
+            raise
         return task.task_id
 
     def make_context_for(self, task: Task):
         return GraphContext(self, task)
 
-    async def run(self, function_registry: FunctionRegistry) -> JSONValue:
+    async def run(
+        self,
+        function_registry: FunctionRegistry,
+        response_cache: Optional[ResponseCache] = None,
+        executors: Optional[CallbackExecutors] = None,
+        journal: Optional["Journal"] = None,
+        release_outputs: Optional[ReleasePolicy] = None,
+        subgraph_cache: Optional[SubgraphCache] = None,
+    ) -> JSONValue:
+        # With release_outputs, outputs that no unfinished task reads are spilled to a
+        # BlobStore, or dropped, to bound memory use; see Scheduler.
         assert not self.started
         self.started = True
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
         self.function_registry = make_base_registry().merge(function_registry)
+        self.input_fingerprint = fingerprint(self.graph_input)
+        self.scheduler = Scheduler(self, self.function_registry, release_outputs)
+        self.response_cache = response_cache
+        # Subgraphs count requests together with the run they are part of.
+        if self.parent_graph is not None and self.parent_graph.started:
+            self.request_occurrences = self.parent_graph.request_occurrences
+        else:
+            self.request_occurrences = RequestOccurrences()
+        self.release_outputs = release_outputs
+        self.subgraph_cache = subgraph_cache
+        self.coalescer = RequestCoalescer(self.function_registry)
+        # Executors passed in belong to the caller (e.g. an enclosing graph's run).
+        owns_executors = executors is None
+        self.executors = executors if executors else CallbackExecutors()
+        if journal:
+            self.add_listener(journal.record)
 
-        # Start all initially available tasks.
-        # N.B.: Tasks added during execution will be started by add_task.
-        for task in self.tasks:
-            task.output = asyncio.create_task(task.run(self, self.function_registry))
-
-        def cancel_all_tasks():
-            for task in self.tasks:
-                assert task.output is not None
-                task.output.cancel()
-
-        # while any task is not started or not done, and no tasks have exceptions
-        while any(
-            task.output and not task.output.done() for task in self.tasks
-        ) and not any(
-            task.output and task.output.done() and task.output.exception() is not None
-            for task in self.tasks
-        ):
-            # wait for every started task to be done
-            try:
-                await asyncio.wait(
-                    [task.output for task in self.tasks if task.output is not None]
-                )
-            except asyncio.CancelledError:
-                cancel_all_tasks()
-                raise
-
-        # If any task has an exception, raise it.
-        for task in self.tasks:
-            assert task.output is not None
-            if task.output.done() and task.output.exception() is not None:
-                cancel_all_tasks()
-                raise Exception("Subtask failed.") from task.output.exception()
-
-        self.started = False
-        self.function_registry = None
+        try:
+            # Nested runs share the sessions opened by the outermost one.
+            async with self.function_registry.open_sessions():
+                await self.scheduler.run()
+        finally:
+            self.started = False
+            self.function_registry = None
+            self.input_fingerprint = None
+            self.scheduler = None
+            self.response_cache = None
+            self.request_occurrences = None
+            self.release_outputs = None
+            self.subgraph_cache = None
+            self.coalescer = None
+            if owns_executors:
+                self.executors.shutdown()
+            self.executors = None
+            self.loop = None
+            self.loop_thread = None
+            if journal:
+                self.remove_listener(journal.record)
 
         if self.output_task is None:
             return None
         assert self.output_task.output is not None
         return await self.output_task.output
 
+    async def run_subgraph(self, task: TaskGraphTask) -> JSONValue:
+        # Nested graphs share the registry and resources of the enclosing run, and report
+        # their events through this graph.
+        assert self.function_registry is not None
+
+        # Held locally: cancelled subgraphs may finish after this graph's run has ended.
+        subgraph_cache = self.subgraph_cache
+        cache_key = None
+        if subgraph_cache is not None:
+            cache_key = subgraph_cache.key(task.subgraph, task.graph_input)
+        if cache_key is not None:
+            assert subgraph_cache is not None
+            cached = await subgraph_cache.get(cache_key)
+            if cached is not None:
+                task.subgraph = cached
+                cached.parent_task = task
+                cached.parent_graph = self
+                self.emit(TaskEvent(TASK_RESTORED, task))
+                return cached.output_task.output_data if cached.output_task else None
+
+        def forward(event: TaskEvent) -> None:
+            self.emit(event.in_subgraph_of(task.task_id))
+
+        task.subgraph.add_listener(forward)
+        try:
+            output = await task.subgraph.run(
+                self.function_registry,
+                response_cache=self.response_cache,
+                executors=self.executors,
+                release_outputs=self.release_outputs,
+                subgraph_cache=subgraph_cache,
+            )
+        except BaseException:
+            if subgraph_cache is not None and cache_key is not None:
+                subgraph_cache.abandon(cache_key)
+            raise
+        finally:
+            task.subgraph.remove_listener(forward)
+        if subgraph_cache is not None and cache_key is not None:
+            subgraph_cache.put(cache_key, task.subgraph)
+        return output
+
+    def clone(self) -> "TaskGraph":
+        # An independent copy of this graph's tasks and their state, without going through
+        # JSON. Listeners are not copied.
+        graph = TaskGraph()
+        clones: dict[Task, Task] = {}
+        for task in self._tasks:
+            clones[task] = task.clone(clones)
+            graph._append(clones[task])
+        graph.graph_input = self.graph_input
+        graph.output_task = clones[self.output_task] if self.output_task else None
+        return graph
+
     def to_json(self) -> JSON:
         return {
-            "tasks": [task.to_json() for task in self.tasks],
+            "tasks": [task.to_json() for task in self._tasks],
             "graph_input": self.graph_input,
             "output_task": self.output_task.task_id if self.output_task else None,
         }
@@ -93,25 +398,46 @@ class TaskGraph:
     @classmethod
     def from_json(cls, json: JSON) -> "TaskGraph":
         graph = TaskGraph()
-        graph.tasks = []
         json_tasks = json["tasks"]
         assert isinstance(json_tasks, list)
         for task_json in json_tasks:
-            tasks_by_id = {task.task_id: task for task in graph.tasks}
             assert isinstance(task_json, dict)
-            task = task_from_json(task_json, tasks_by_id)
-            graph.tasks.append(task)
+            graph._append(task_from_json(task_json, graph._tasks_by_id))
         graph.graph_input = json["graph_input"]
-        graph.output_task = next(
-            (task for task in graph.tasks if task.task_id == json["output_task"]), None
+        output_task_id = json["output_task"]
+        assert isinstance(output_task_id, str | None)
+        graph.output_task = (
+            graph._tasks_by_id.get(output_task_id) if output_task_id else None
         )
         return graph
 
 
 class GraphContext:
-    def __init__(self, graph: TaskGraph, task: Task):
+    def __init__(self, graph: TaskGraph, task: Task, stage: Optional[str] = None):
         self.graph = graph
         self.task = task
+        # The part of the task's execution that this context is passed to, e.g. an
+        # LLMTask's prompt formatter; None for the execution as a whole. Tasks added
+        # through the context record it, so that when a task runs again, only the tasks
+        # added by the parts that actually run again are replaced.
+        self.stage = stage
+
+    def in_stage(self, stage: str) -> "GraphContext":
+        nested_stage = f"{self.stage}/{stage}" if self.stage else stage
+        return GraphContext(self.graph, self.task, nested_stage)
+
+    def remove_created_tasks(self, nested: bool = False) -> None:
+        # Removes the tasks added through this context's stage by a previous run, and
+        # with `nested`, those added by the stages within it.
+        stages: set[Optional[str]] = {self.stage}
+        if nested:
+            prefix = f"{self.stage}/" if self.stage else ""
+            stages.update(
+                task.created_in
+                for task in self.graph.tasks_created_by(self.task)
+                if task.created_in and task.created_in.startswith(prefix)
+            )
+        self.graph.remove_tasks_created_by(self.task, stages)
 
     def graph_input(self):
         return self.graph.graph_input
@@ -119,8 +445,24 @@ class GraphContext:
     def list_tasks(self):
         return self.graph.tasks
 
+    def get_task(self, task_id: str):
+        return self.graph.get_task(task_id)
+
     def add_task(self, new_task: Task):
+        new_task.created_by = self.task
+        new_task.created_in = self.stage
         return self.graph.add_task(new_task)
 
+    def add_tasks(self, new_tasks: list[Task]):
+        for new_task in new_tasks:
+            new_task.created_by = self.task
+            new_task.created_in = self.stage
+        return self.graph.add_tasks(new_tasks)
+
     def add_output_task(self, new_task: Task):
+        new_task.created_by = self.task
+        new_task.created_in = self.stage
         return self.graph.add_output_task(new_task)
+
+    def report_progress(self):
+        self.graph.emit(TaskEvent(TASK_PROGRESS, self.task))
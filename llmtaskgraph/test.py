@@ -8,11 +8,17 @@ import openai
 
 from llmtaskgraph.function_registry import FunctionRegistry, openai_chat
 
+from .cassette import Cassette
 from .task import LLMTask, PythonTask
 from .task_graph import TaskGraph, GraphContext
 
 load_dotenv()
-openai.api_key = os.environ["OPENAI_API_KEY"]
+# Set LLMTASKGRAPH_CASSETTE to a cassette file to replay recorded API responses instead of
+# calling OpenAI. Also set LLMTASKGRAPH_CASSETTE_MODE=record to record a new one.
+cassette_path = os.environ.get("LLMTASKGRAPH_CASSETTE")
+cassette_mode = os.environ.get("LLMTASKGRAPH_CASSETTE_MODE", "replay")
+if cassette_path is None or cassette_mode == "record":
+    openai.api_key = os.environ["OPENAI_API_KEY"]
 
 # A TaskGraph is an executable collection of tasks with modeled information flow
 task_graph = TaskGraph()
@@ -87,6 +93,11 @@ task_graph.graph_input = "famous mathematicians"
 llm_tasks = add_llm_tasks()
 add_python_tasks(llm_tasks)
 
+if cassette_path:
+    function_registry = Cassette(cassette_path, cassette_mode).wrap_registry(
+        function_registry
+    )
+
 # Task graphs can be serialized and deserialized
 serialized = json.dumps(task_graph.to_json())
 task_graph = TaskGraph.from_json(json.loads(serialized))
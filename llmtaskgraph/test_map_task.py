@@ -0,0 +1,88 @@
+import asyncio
+import json
+
+from llmtaskgraph.function_registry import FunctionRegistry
+from llmtaskgraph.task import MapTask, PythonTask, TaskGraphTask
+from llmtaskgraph.task_graph import GraphContext, TaskGraph
+
+# MapTasks run offline, so unlike test.py these don't need an OpenAI key. Run with
+# `python -m llmtaskgraph.test_map_task`.
+function_registry = FunctionRegistry()
+
+
+def numbers() -> list[int]:
+    return [1, 2, 3]
+
+
+def item_as_input(context: GraphContext, item: int) -> int:
+    return item
+
+
+def double_input(context: GraphContext) -> int:
+    return context.graph_input() * 2
+
+
+def count_to_input(context: GraphContext) -> list[int]:
+    return list(range(context.graph_input()))
+
+
+def log_item(context: GraphContext, item: int) -> int:
+    context.add_task(PythonTask(double_input_id))
+    return item
+
+
+numbers_id = function_registry.register_no_context(numbers)
+item_as_input_id = function_registry.register(item_as_input)
+double_input_id = function_registry.register(double_input)
+count_to_input_id = function_registry.register(count_to_input)
+log_item_id = function_registry.register(log_item)
+
+
+def make_subgraph_map_graph() -> TaskGraph:
+    subgraph = TaskGraph()
+    subgraph.add_output_task(PythonTask(double_input_id))
+    task_graph = TaskGraph()
+    items = PythonTask(numbers_id)
+    task_graph.add_task(items)
+    task_graph.add_output_task(
+        MapTask(TaskGraphTask(subgraph, item_as_input_id), items)
+    )
+    return task_graph
+
+
+def test_map_subgraph_template():
+    # Each element runs its own copy of the template's subgraph.
+    task_graph = make_subgraph_map_graph()
+    assert asyncio.run(task_graph.run(function_registry)) == [2, 4, 6]
+
+    # And a trace of it can be loaded and run again.
+    serialized = json.dumps(task_graph.to_json())
+    task_graph = TaskGraph.from_json(json.loads(serialized))
+    assert asyncio.run(task_graph.run(function_registry)) == [2, 4, 6]
+
+
+def test_map_template_adds_tasks():
+    # Tasks added by the template's callbacks belong to their element.
+    task_graph = TaskGraph()
+    task_graph.graph_input = 3
+    items = PythonTask(count_to_input_id)
+    task_graph.add_task(items)
+    task_graph.add_output_task(MapTask(PythonTask(log_item_id), items))
+    assert asyncio.run(task_graph.run(function_registry)) == [0, 1, 2]
+    assert len(task_graph.tasks) == 5
+
+    # Elements that are memoized keep them.
+    serialized = json.dumps(task_graph.to_json())
+    task_graph = TaskGraph.from_json(json.loads(serialized))
+    assert asyncio.run(task_graph.run(function_registry)) == [0, 1, 2]
+    assert len(task_graph.tasks) == 5
+
+    # And elements that no longer exist remove them.
+    task_graph.graph_input = 2
+    assert asyncio.run(task_graph.run(function_registry)) == [0, 1]
+    assert len(task_graph.tasks) == 4
+
+
+if __name__ == "__main__":
+    test_map_subgraph_template()
+    test_map_template_adds_tasks()
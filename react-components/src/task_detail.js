@@ -102,6 +102,9 @@ export function LLMTaskDetail({ task, onEdit, editEnabled }) {
         onEdit={onEdit}
         editEnabled={editEnabled}
       />
+      {task.partial_response ? (
+        <div>Streaming response: {task.partial_response}</div>
+      ) : null}
       <TaskField
         task={task}
         fieldName="output_data"
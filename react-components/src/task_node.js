@@ -30,6 +30,17 @@ function TaskGraphTaskSummary(task, task_state) {
   );
 }
 
+function MapTaskSummary(task, task_state) {
+  return (
+    <>
+      <div>
+        MapTask ({task_state}, {task.items.length} items)
+      </div>
+      <div>{TaskSummary(task.template, task_state)}</div>
+    </>
+  );
+}
+
 function TaskSummary(task, task_state) {
   switch (task.type) {
     case "LLMTask":
@@ -38,6 +49,8 @@ function TaskSummary(task, task_state) {
       return PythonTaskSummary(task, task_state);
     case "TaskGraphTask":
       return TaskGraphTaskSummary(task, task_state);
+    case "MapTask":
+      return MapTaskSummary(task, task_state);
     default:
       return (
         <div>